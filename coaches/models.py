@@ -74,7 +74,7 @@ class Coaching(models.Model):
     def current(**kwargs):
         """Get the current list of coaches."""
 
-        return Coaching.objects.filter(competition__active=True, **kwargs)
+        return Coaching.objects.filter(competition_id=Competition.current_id(), **kwargs)
 
 
 class Team(models.Model):
@@ -82,20 +82,50 @@ class Team(models.Model):
 
     name = models.CharField(max_length=64)
     number = models.IntegerField(default=0)
+    # Lower-cased name searched by prefix, which a plain index can serve
+    # with a case sensitive match where it cannot with one ignoring case
+    name_key = models.CharField(max_length=64, editable=False, db_index=True)
     school = models.ForeignKey(School, related_name="teams")
     competition = models.ForeignKey(Competition, related_name="teams")
     division = models.IntegerField(choices=DIVISIONS)
 
+    class Meta:
+        """Meta information about the team."""
+
+        indexes = [models.Index(fields=["competition", "number", "id"], name="team_number")]
+
+    # Fields that grades depend on, see `grading.signals`
+    GRADED_FIELDS = ("competition_id", "division")
+
     def __str__(self):
         """Represent the team as a string."""
 
         return "Team[{}]".format(self.name)
 
+    def save(self, *args, **kwargs):
+        """Save the team along with its lower-cased name."""
+
+        self.name_key = self.name.lower()
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the stored fields grades depend on."""
+
+        team = super().from_db(db, field_names, values)
+        team._loaded_graded = team.graded_fields()
+        return team
+
+    def graded_fields(self) -> tuple:
+        """Get the fields grades depend on, skipping deferred ones."""
+
+        return tuple(self.__dict__.get(field) for field in self.GRADED_FIELDS)
+
     @staticmethod
     def current(**kwargs):
         """Get the teams for the current competition."""
 
-        return Team.objects.filter(competition__active=True, **kwargs)
+        return Team.objects.filter(competition_id=Competition.current_id(), **kwargs)
 
     def get_students_display(self):
         """Get the comma separated list of students."""
@@ -108,6 +138,9 @@ class Student(models.Model):
 
     first_name = models.CharField(max_length=64)
     last_name = models.CharField(max_length=64)
+    # Lower-cased names searched by prefix, see `Team.name_key`
+    first_name_key = models.CharField(max_length=64, editable=False, db_index=True)
+    last_name_key = models.CharField(max_length=64, editable=False, db_index=True)
 
     team = models.ForeignKey(Team, related_name="students")
     subject1 = models.CharField(max_length=2, blank=True, choices=SUBJECTS, verbose_name="Subject 1")
@@ -122,12 +155,36 @@ class Student(models.Model):
         """Meta information about the student."""
 
         ordering = ('last_name',)
+        indexes = [models.Index(fields=["last_name", "id"], name="student_last_name")]
+
+    # Fields that grades depend on, see `grading.signals`
+    GRADED_FIELDS = ("team_id", "subject1", "subject2", "attending")
 
     def __str__(self):
         """Represent the student as a string."""
 
         return "Student[{}]".format(self.get_full_name())
 
+    def save(self, *args, **kwargs):
+        """Save the student along with their lower-cased names."""
+
+        self.first_name_key = self.first_name.lower()
+        self.last_name_key = self.last_name.lower()
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the stored fields grades depend on."""
+
+        student = super().from_db(db, field_names, values)
+        student._loaded_graded = student.graded_fields()
+        return student
+
+    def graded_fields(self) -> tuple:
+        """Get the fields grades depend on, skipping deferred ones."""
+
+        return tuple(self.__dict__.get(field) for field in self.GRADED_FIELDS)
+
     def get_full_name(self):
         """Get the user's full name."""
 
@@ -143,7 +200,7 @@ class Student(models.Model):
     def current(**kwargs):
         """Get the students in the current competition."""
 
-        return Student.objects.filter(team__competition__active=True, **kwargs)
+        return Student.objects.filter(team__competition_id=Competition.current_id(), **kwargs)
 
 
 class Chaperone(models.Model):
@@ -168,4 +225,4 @@ class Chaperone(models.Model):
     def current(**kwargs):
         """Get the students in the current competition."""
 
-        return Chaperone.objects.filter(competition__active=True, **kwargs)
+        return Chaperone.objects.filter(competition_id=Competition.current_id(), **kwargs)
@@ -29,7 +29,7 @@ def school_required(view):
     """Wrap a view to require the user to have a school."""
 
     def wrapper(request, *args, **kwargs):
-        coaching = models.Coaching.objects.filter(coach=request.user, competition__active=True).first()
+        coaching = models.Coaching.current(coach=request.user).first()
         if coaching is None:
             return redirect("coaches:school")
 
@@ -102,7 +102,7 @@ def inactive(request):
 def schools(request):
     """Allow the coach to select a school for the current competition."""
 
-    if models.Coaching.objects.filter(coach=request.user, competition__active=True).exists():
+    if models.Coaching.current(coach=request.user).exists():
         return redirect("coaches:index")
 
     existing = None
@@ -121,7 +121,7 @@ def schools(request):
                 school = models.School.objects.get(name=form.cleaned_data["school"])
 
             # Check if someone is already coaching
-            coaching = models.Coaching.objects.filter(school=school, competition__active=True).first()
+            coaching = models.Coaching.current(school=school).first()
 
             if coaching is None:
                 models.Coaching.objects.create(
@@ -13,14 +13,15 @@ DAVID WRITE SOMETHING HERE?
 from django.db.models import Q
 
 import math
-import statistics
 
-import scipy.optimize
+import numpy
 
 import grading.models as g
 import coaches.models as c
-from grading.grading import CompetitionGrader, ChillDictionary, cached
+from grading.grading import CompetitionGrader, ChillDictionary, cached, vectorized
+from grading.grading import GraderCache, ROUND, ATTENDANCE, solve_power_averages, map_divisions
 from grading.models import CORRECT, ESTIMATION
+from grading.statistics import attending_counts
 
 
 SUBJECT1 = "subject1"
@@ -40,7 +41,15 @@ class Grader(CompetitionGrader):
 
     LAMBDA = 0.52
 
-    cache = {}
+    # Weights of the parts of the overall team score
+    TEAM_WEIGHTS = {"individual": 0.4, TEAM: 0.3, GUTS: 0.3}
+
+    # Guts totals are kept up to date for the live scoreboard and
+    # checked against a full regrade every few minutes
+    RUNNING_TOTALS = (GUTS,)
+    VERIFY_INTERVAL = 300
+
+    cache = GraderCache("mbmt2018")
 
     def __init__(self, competition: g.Competition):
         """Initialize the MBMT 2017 grader."""
@@ -48,6 +57,7 @@ class Grader(CompetitionGrader):
         super().__init__(competition)
         self.individual_bonus = {}
         self.individual_powers = {}
+        self._individual_exponents = {}
 
         # Question graders
         self.register_question_grader(
@@ -66,23 +76,10 @@ class Grader(CompetitionGrader):
         self.individual_bonus = {}
 
         factors = ChillDictionary({division: ChillDictionary() for division in c.DIVISIONS_MAP})
-        for i, round in enumerate((round1, round2)):
-            for question in round.questions.all():
-                for answer in g.Answer.objects.filter(question=question).all():
-
-                    # Ignore absent students
-                    if not answer.student.attending:
-                        continue
-
-                    # Ignores people2017 whose grading view is not opened
-                    division = answer.student.team.division
-                    subject = answer.student.subject1 if i == 0 else answer.student.subject2
 
-                    # Set atomic factor to correct and total values
-                    if question.number not in factors[division][subject]:
-                        factors[division][subject][question.number] = [0, 0]  # Correct, total
-                    factors[division][subject][question.number][0] += answer.value or 0
-                    factors[division][subject][question.number][1] += 1
+        # Correct and total answers of attending students by question
+        for (division, subject, number), counts in attending_counts(round1, round2).items():
+            factors[division][subject][number] = counts
 
         for division in factors:
             self.individual_bonus[division] = {}
@@ -93,30 +90,88 @@ class Grader(CompetitionGrader):
                     self.individual_bonus[division][subject][question] = (
                         0 if correct == 0 else self.LAMBDA * math.log(total / (correct+1)))
 
-    def _power_average_partial(self, scores):
-        """Return a partial that averages scores raised to a power."""
+    def _calculate_individual_exponents(self, score_sets):
+        """Determines the exponents for individual subject tests together.
+
+        Score sets are keyed by division and subject. Only those whose
+        scores changed since the last calculation are solved again, the
+        rest reuse the exponent found for them then.
+        """
+
+        changed = {}
+        for key, scores in score_sets.items():
+            scores = tuple(sorted(scores))
+            if self._individual_exponents.get(key, (None,))[0] != scores:
+                changed[key] = scores
+
+        # Each division is solved separately, possibly in another process
+        divisions = {}
+        for key in changed:
+            divisions.setdefault(key[0], []).append(key)
+        exponents = map_divisions(solve_power_averages, {
+            division: ([changed[key] for key in keys], 0.375, 0.0001, 1000) for division, keys in divisions.items()})
+        for division, keys in divisions.items():
+            for key, exponent in zip(keys, exponents[division]):
+                self._individual_exponents[key] = (changed[key], exponent)
+        return {key: self._individual_exponents[key][1] for key in score_sets}
 
-        def power_average(d):
-            return 0.375 - 1.0/len(scores) * sum(pow(score, d) for score in scores if score != 0)
-        return power_average
+    def _subject_column_grader(self, question, values, answers, field):
+        """Grade a column of individual answers with per-subject bonuses."""
 
-    def _calculate_individual_exponent(self, scores):
-        """Determines the exponent for an individual subject test."""
+        bonus = numpy.zeros(len(values))
+        for (division, subject), rows in answers.rows_by("team.division", field).items():
+            bonus[rows] = self.individual_bonus.get(division, {}).get(subject, {}).get(question.number, 0)
+        return question.weight * numpy.nan_to_num(values) * (1 + bonus)
 
-        return scipy.optimize.newton(self._power_average_partial(scores), 1, tol=0.0001, maxiter=1000)
+    def subject1_column_grader(self, question, values, answers):
+        """Grade a column of individual answers."""
 
+        return self._subject_column_grader(question, values, answers, SUBJECT1)
+
+    def subject2_column_grader(self, question, values, answers):
+        """Grade a column of individual answers."""
+
+        return self._subject_column_grader(question, values, answers, SUBJECT2)
+
+    @vectorized(subject1_column_grader)
     def subject1_question_grader(self, question, answer):
         """Grade an individual question."""
 
         return (question.weight * (answer.value or 0) * (1 +
                 self.individual_bonus[answer.student.team.division][answer.student.subject1][question.number]))
 
+    @vectorized(subject2_column_grader)
     def subject2_question_grader(self, question, answer):
         """Grade an individual question."""
 
         return (question.weight * (answer.value or 0) * (1 +
                 self.individual_bonus[answer.student.team.division][answer.student.subject2][question.number]))
 
+    def guts_column_grader(self, question: g.Question, values, answers):
+        """Grade a column of guts answers."""
+
+        if question.type == g.QUESTION_TYPES["correct"]:
+            return numpy.nan_to_num(values) * question.weight
+
+        e = values
+        a = question.answer
+        value = numpy.zeros(len(values))
+        with numpy.errstate(all="ignore"):
+            # Keep in sync with the estimation formulas below
+            if question.number == 26:
+                value = 12*numpy.minimum(e/a, a/e)**3
+            elif question.number == 27:
+                value = numpy.maximum(0, 12-6*numpy.abs(a-e))
+            elif question.number == 28:
+                value = numpy.maximum(0, 12-120*numpy.abs(a-e)/a)
+            elif question.number == 29:
+                value = 12*numpy.minimum(e/a, a/e)
+            elif question.number == 30:
+                value = numpy.maximum(0, 12-500*(numpy.abs(a-e)/a)**2)
+            value = numpy.where(e > 0, value, 0)
+        return numpy.nan_to_num(value) * question.weight
+
+    @vectorized(guts_column_grader)
     def guts_question_grader(self, question: g.Question, answer: g.Answer):
         """Grade a guts question."""
 
@@ -141,44 +196,40 @@ class Grader(CompetitionGrader):
                 value = 0 if e <= 0 else max(0, 12-500*(abs(a-e)/a)**2)
         return value * question.weight
 
-    def z_score(self, raw_scores):
-        """General team round grader based on Z score."""
-
-        scores = ChillDictionary()
-        for division in raw_scores:
-            scores[division] = ChillDictionary()
-            data = list(map(lambda team: raw_scores[division][team], raw_scores[division]))
-            mean = statistics.mean(data)
-            dev = statistics.stdev(data, mean)
-            for team in raw_scores[division]:
-                scores[division][team] = 0 if dev == 0 else (raw_scores[division][team] - mean) / dev
-        return scores.dict()
-
-    @cached(cache, "team_scores")
+    @cached(cache, "team_scores", depends_on=[(ROUND, TEAM)])
     def team_round_grader(self, round: g.Round):
         """Grader for the team round."""
 
         raw_scores = self.grade_round(round)
-        self.cache_set("raw_team_scores", raw_scores)
+        self.cache_set("raw_team_scores", raw_scores, depends_on=["team_scores"])
         return self.z_score(raw_scores)
 
     # Cached for use in live grading
-    @cached(cache, "guts_scores")
+    @cached(cache, "guts_scores", depends_on=[(ROUND, GUTS)])
     def guts_round_grader(self, round: g.Round):
         """Grader for the guts round."""
 
         raw_scores = self.grade_round(round)
-        self.cache_set("raw_guts_scores", raw_scores)
+        self.cache_set("raw_guts_scores", raw_scores, depends_on=["guts_scores"])
+        self.cache_set("guts_drift", self.verify_running_totals(round, raw_scores))
         return self.z_score(raw_scores)
 
-    @cached(cache, "raw_guts_score")
+    @cached(cache, "guts_drift")
+    def verify_guts_totals(self):
+        """Regrade the guts round to check its running totals."""
+
+        round = self.competition.rounds.filter(ref=GUTS).first()
+        return self.verify_running_totals(round)
+
+    @cached(cache, "raw_guts_score", depends_on=[(ROUND, GUTS)])
     def guts_live_round_scores(self):
         """Guts live round."""
 
         round = self.competition.rounds.filter(ref="guts").first()
-        return self.grade_round(round)
+        self.verify_guts_totals(use_cache_before=self.VERIFY_INTERVAL)
+        return self.running_totals(round)
 
-    @cached(cache, "individual_scores")
+    @cached(cache, "individual_scores", depends_on=[(ROUND, SUBJECT1), (ROUND, SUBJECT2), ATTENDANCE])
     def calculate_individual_scores(self):
         """Custom function that groups both subject rounds together."""
 
@@ -212,10 +263,11 @@ class Grader(CompetitionGrader):
                 subject_scores[division][student.subject1][student] = score1
                 subject_scores[division][student.subject2][student] = score2
 
-        self.cache_set("subject_scores", subject_scores.dict())
+        self.cache_set("subject_scores", subject_scores.dict(), depends_on=["individual_scores"])
 
         powers = ChillDictionary()
         max_scores = ChillDictionary()
+        unsolved = {}
         for division in subject_scores:
             for subject in subject_scores[division]:
                 # scores = list(filter(lambda x: x > 0, subject_scores[division][subject].values()))
@@ -225,12 +277,17 @@ class Grader(CompetitionGrader):
 
                 # Doesn't work for fewer than 3 scores
                 if len(scores) >= 3:
-                    powers[division][subject] = self._calculate_individual_exponent(normalize(scores, high))
+                    powers[division][subject] = None
+                    unsolved[division, subject] = normalize(scores, high)
 
                 # Doesn't work for fewer than 3 scores
                 else:
                     powers[division][subject] = 0
+        for (division, subject), power in self._calculate_individual_exponents(unsolved).items():
+            powers[division][subject] = power
         self.individual_powers = powers.dict()
+        self.cache_set("individual_powers", self.individual_powers, depends_on=["individual_scores"])
+        self.cache_set("individual_bonus", self.individual_bonus, depends_on=["individual_scores"])
 
         raw_scores = ChillDictionary()
         final_scores = ChillDictionary()
@@ -248,27 +305,35 @@ class Grader(CompetitionGrader):
                 raw_scores[division][student] = score
                 final_scores[division][student] = score
 
-        self.cache_set("raw_individual_scores", raw_scores.dict())
+        self.cache_set("raw_individual_scores", raw_scores.dict(), depends_on=["individual_scores"])
 
         return final_scores.dict()
 
-    @cached(cache, "team_individual_scores")
+    @cached(cache, "team_individual_scores", depends_on=["individual_scores", ATTENDANCE])
     def calculate_team_individual_scores(self):
         """Custom function that combines team and guts scores."""
 
         raw_scores = self.calculate_individual_scores(use_cache=True)
+
+        # Map teams to the ids of their attending students in one query
+        roster = {}
+        students = c.Student.objects.filter(team__competition=self.competition, attending=True)
+        for student_id, team_id in students.values_list("id", "team_id"):
+            roster.setdefault(team_id, []).append(student_id)
+
+        # Scores by student id within each division
+        student_scores = {division: {student.id: score for student, score in raw_scores[division].items()}
+                          for division in raw_scores}
+
         final_scores = ChillDictionary()
-        for team in c.Team.current():
-            score = 0
-            count = 0
-            for student in team.students.all():
-                if student.attending and team.division in raw_scores and student in raw_scores[team.division]:
-                    score += raw_scores[team.division][student]
-                    count += 1
-            final_scores[team.division][team] = 0 if count == 0 else score / count
+        for team in c.Team.objects.filter(competition=self.competition):
+            division_scores = student_scores.get(team.division, {})
+            scores = [division_scores[id] for id in roster.get(team.id, ()) if id in division_scores]
+            final_scores[team.division][team] = 0 if not scores else sum(scores) / len(scores)
         return final_scores.dict()
 
-    @cached(cache, "team_overall_scores")
+    @cached(cache, "team_overall_scores", depends_on=[
+        "team_individual_scores", "team_scores", "guts_scores"])
     def calculate_team_scores(self, use_cache=True):
         """Calculate the team scores."""
 
@@ -278,18 +343,10 @@ class Grader(CompetitionGrader):
         team_round_scores = self.team_round_grader(team_round, use_cache=use_cache)
         guts_round_scores = self.guts_round_grader(guts_round, use_cache=use_cache)
 
-        final_scores = ChillDictionary()
-        for team in c.Team.current():
-            score = 0
-            if team in individual_scores[team.division]:
-                score += 0.4 * individual_scores[team.division][team]
-            if team in team_round_scores[team.division]:
-                score += 0.3 * team_round_scores[team.division][team]
-            if team in guts_round_scores[team.division]:
-                score += 0.3 * guts_round_scores[team.division][team]
-
-            final_scores[team.division][team] = score
-        return final_scores.dict()
+        return self.combine_scores(c.Team.objects.filter(competition=self.competition), (
+            (self.TEAM_WEIGHTS["individual"], individual_scores),
+            (self.TEAM_WEIGHTS[TEAM], team_round_scores),
+            (self.TEAM_WEIGHTS[GUTS], guts_round_scores)))
 
     def grade_competition(self):
         """Grade the entire competition."""
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class GradingConfig(AppConfig):
     name = 'grading'
+
+    def ready(self):
+        """Connect the cache invalidation signals."""
+
+        from . import signals
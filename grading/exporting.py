@@ -0,0 +1,170 @@
+"""Grade competitions offline and write their scoreboards to files.
+
+Grading a competition runs the same pipeline as the scoreboard pages,
+individual scores first and then team scores, and writes the ranked
+individual, subject, and team scoreboards along with the intermediate
+outputs the grader cached on the way, such as raw round scores and the
+individual exponents and bonuses. Files are written to a directory per
+competition:
+
+  <directory>/<id>-<name>/
+    individual.csv    division, rank, name, score
+    subjects.csv      division, subject, rank, name, score
+    teams.csv         division, rank, name, guts, guts z, team, team z,
+                      individual, overall
+    intermediate.csv  output, keys, value
+
+JSON output holds the same rows, with the intermediate outputs nested
+by key. Students and teams are written by id in intermediate outputs.
+"""
+
+from django.utils.text import slugify
+
+import os
+import csv
+import json
+import time
+import contextlib
+
+from coaches.models import Student, Team
+from . import models, grading, snapshots
+
+
+CSV = "csv"
+JSON = "json"
+
+SCOREBOARDS = {
+    "individual": ("division", "rank", "name", "score"),
+    "subjects": ("division", "subject", "rank", "name", "score"),
+    "teams": ("division", "rank", "name", "guts", "guts z", "team", "team z", "individual", "overall")}
+
+
+class GradingReport:
+    """Timings and files of grading a competition offline."""
+
+    def __init__(self, competition: models.Competition, directory: str):
+        """Initialize an empty report."""
+
+        self.competition = competition
+        self.directory = directory
+        self.timings = []
+        self.files = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time a stage of grading."""
+
+        start = time.time()
+        yield
+        self.timings.append((name, time.time() - start))
+
+
+def _key(key):
+    """Write students and teams by id."""
+
+    return key.id if isinstance(key, (Student, Team)) else key
+
+
+def _nest(value):
+    """Convert an output to JSON with students and teams by id."""
+
+    if isinstance(value, dict):
+        return {str(_key(key)): _nest(item) for key, item in value.items()}
+    return value
+
+
+def _rows(value, path=()):
+    """Flatten an output to rows of keys and a value."""
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _rows(item, path + (_key(key),))
+    else:
+        yield path + (value,)
+
+
+def _ranked(divisions):
+    """Number the ranked rows of each division of a prepared scoreboard."""
+
+    for division, rows in divisions:
+        for rank, row in enumerate(rows, 1):
+            yield (division, rank) + tuple(row)
+
+
+def graded_outputs(grader: grading.CompetitionGrader, start: float, **results) -> dict:
+    """Collect the snapshotted outputs of grading since a time.
+
+    Results returned by the grader and outputs it wrote itself since
+    then take precedence over the shared cache, which another process
+    may invalidate while the competition is being graded.
+    """
+
+    collected = {name: grader.cache_get(name) for name, _ in snapshots.SNAPSHOT}
+    collected.update((name, grader.written[name][1]) for name, _ in snapshots.SNAPSHOT
+                     if name in grader.written and grader.written[name][0] >= start)
+    collected.update(results)
+    return {name: output for name, output in collected.items() if output is not None}
+
+
+def scoreboards(outputs: dict) -> dict:
+    """Rank the scores of a graded competition by scoreboard."""
+
+    needed = ("subject_scores", "individual_scores", "raw_guts_scores", "guts_scores", "raw_team_scores",
+              "team_scores", "team_individual_scores", "team_overall_scores")
+    missing = [name for name in needed if name not in outputs]
+    if missing:
+        raise ValueError("grading did not produce {}".format(", ".join(missing)))
+
+    subjects = []
+    for division, rows in grading.prepare_subject_scores(outputs["subject_scores"]):
+        for subject, students in rows:
+            subjects.extend((division, subject, rank) + tuple(row) for rank, row in enumerate(students, 1))
+
+    return {
+        "individual": list(_ranked(grading.prepare_individual_scores(outputs["individual_scores"]))),
+        "subjects": subjects,
+        "teams": list(_ranked(grading.prepare_composite_team_scores(
+            outputs["raw_guts_scores"], outputs["guts_scores"],
+            outputs["raw_team_scores"], outputs["team_scores"],
+            outputs["team_individual_scores"], outputs["team_overall_scores"])))}
+
+
+def _write(report: GradingReport, name: str, format: str, header, rows, nested=None):
+    """Write rows to a CSV file or as JSON, nested instead if given."""
+
+    path = os.path.join(report.directory, "{}.{}".format(name, format))
+    with open(path, "w", newline="") as file:
+        if format == CSV:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(rows)
+        else:
+            rows = nested if nested is not None else [dict(zip(header, row)) for row in rows]
+            json.dump(rows, file, indent=1, default=float)
+    report.files.append(path)
+
+
+def grade(competition: models.Competition, directory: str, format: str=JSON) -> GradingReport:
+    """Grade a competition from scratch and write its scoreboards."""
+
+    directory = os.path.join(directory, "{}-{}".format(competition.id, slugify(competition.name)))
+    os.makedirs(directory, exist_ok=True)
+    report = GradingReport(competition, directory)
+    grader = competition.grader
+    start = time.time()
+
+    with report.stage("individual"):
+        individual_scores = grader.calculate_individual_scores(use_cache=False)
+    with report.stage("team"):
+        team_overall_scores = grader.calculate_team_scores(use_cache=False)
+
+    with report.stage("write"):
+        graded = graded_outputs(
+            grader, start, individual_scores=individual_scores, team_overall_scores=team_overall_scores)
+        for name, rows in scoreboards(graded).items():
+            _write(report, name, format, SCOREBOARDS[name], rows)
+        _write(report, "intermediate", format, ("output", "keys", "value"),
+               ((name, "/".join(map(str, row[:-1])), row[-1]) for name in graded for row in _rows(graded[name])),
+               {name: _nest(output) for name, output in graded.items()})
+
+    return report
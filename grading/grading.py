@@ -14,42 +14,429 @@ provided its answer, and second to grade rounds based on the result of
 the values returned.
 """
 
-from django.db.models import Q
-
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import connections, transaction
+from django.db.models import Q, F
+
+import os
+import copy
 import time
+import fcntl
+import hashlib
+import inspect
+import functools
+import importlib
+import logging
+import operator
+import threading
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
 
 import coaches.models
-from . import models
+from . import models, statistics
 
 
 ROUND = "round"
 QUESTION = "question"
 
+logger = logging.getLogger(__name__)
+
+# Answer foreign key by round grouping and the relations to join
+GROUPS = {
+    models.INDIVIDUAL: "student",
+    models.TEAM: "team"}
+RELATED = {
+    "student": ("student", "student__team"),
+    "team": ("team",)}
+
+
+ATTENDANCE = "attendance"
+CHANGED = "grading:changed:{}"
+VERSION = ".version"
+COMPUTING = ".computing"
+MEMO = ".memo"
+
+# Rows per query when writing answers in bulk
+BATCH_SIZE = 500
+
+# Seconds before an abandoned recomputation may be claimed again
+COMPUTE_TIMEOUT = 120
+CLAIMS_LOCK = threading.Lock()
+CLAIMS_FILE = "claims.lock"
+
+# Cached names and what they depend on, by cache container
+DEPENDENCIES = {}
+
+# Grader caches scoped to a single competition, by container and scope
+SCOPES = {}
+
+# Checksums of grader module sources, by module name
+SOURCES = {}
+
+# Worker processes for per-division work, or zero to work in process
+PROCESSES = getattr(settings, "GRADING_PROCESSES", 0)
+POOL = []
+POOL_LOCK = threading.Lock()
+
+# Graders kept alive at once, see `GraderRegistry`
+REGISTRY_SIZE = getattr(settings, "GRADER_REGISTRY_SIZE", 4)
+STRUCTURE = "grading:structure:{}"
+
+# Related models loaded along with cached students and teams
+CACHE_RELATED = {
+    "coaches.Student": ("team", "team__school"),
+    "coaches.Team": ("school",)}
+
 
 class CachedGrade:
-    """Meta container object that stores cached results and timing."""
+    """Meta container object that stores cached results and timing.
 
-    def __init__(self, result, when=None):
+    Results also record the changes they were computed from, such as
+    `(ROUND, ref)` pairs, so that any process can tell whether they are
+    stale without knowing how they were declared, see `is_fresh`.
+    """
+
+    inputs = ()
+
+    def __init__(self, result, when=None, inputs=()):
         """Initialize a cache object."""
 
         self.result = result
         self.time = when or time.time()
+        self.inputs = tuple(inputs)
+
+
+class Ref(collections.namedtuple("Ref", ("model", "id"))):
+    """Serializable reference to a student or team in a cached result."""
+
+
+def dehydrate(value):
+    """Replace model instances in a result with references."""
+
+    if isinstance(value, (coaches.models.Student, coaches.models.Team)):
+        return Ref(value._meta.label, value.id)
+    if isinstance(value, dict):
+        return type(value)((dehydrate(key), dehydrate(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)) and not isinstance(value, Ref):
+        return type(value)(map(dehydrate, value))
+    return value
+
+
+def _refs(value, found):
+    """Collect the references in a dehydrated result by model."""
+
+    if isinstance(value, Ref):
+        found.setdefault(value.model, set()).add(value.id)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            _refs(key, found)
+            _refs(item, found)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _refs(item, found)
+    return found
+
+
+def hydrate(value):
+    """Replace references in a result with model instances.
+
+    Instances are loaded with a single query per model. Entries of
+    students or teams that no longer exist are dropped.
+    """
+
+    instances = {}
+    for label, ids in _refs(value, {}).items():
+        model = apps.get_model(label)
+        loaded = model.objects.select_related(*CACHE_RELATED.get(label, ())).in_bulk(ids)
+        for id, instance in loaded.items():
+            instances[Ref(label, id)] = instance
+
+    missing = object()
+
+    def replace(value):
+        if isinstance(value, Ref):
+            return instances.get(value, missing)
+        if isinstance(value, dict):
+            items = ((replace(key), replace(item)) for key, item in value.items())
+            return type(value)((key, item) for key, item in items if key is not missing and item is not missing)
+        if isinstance(value, (list, tuple)):
+            return type(value)(item for item in map(replace, value) if item is not missing)
+        return value
+
+    return replace(value)
+
+
+class GraderCache:
+    """Grader cache container stored in a Django cache backend.
+
+    The container behaves enough like a dictionary to be used wherever
+    one is, but stores its items in the backend named by the
+    `GRADER_CACHE` setting, so that every worker process shares the same
+    results. Students and teams are stored by id and loaded again when
+    read, so cached results are never stale model instances.
+    """
+
+    def __init__(self, prefix: str, alias: str=None):
+        """Initialize the cache with a key prefix."""
+
+        self.prefix = prefix
+        self.alias = alias
+
+    @property
+    def backend(self):
+        """Get the Django cache backend."""
+
+        return caches[self.alias or getattr(settings, "GRADER_CACHE", "default")]
+
+    def key(self, name):
+        """Get the backend key for a cached name."""
+
+        return "grading:{}:{}".format(self.prefix, name)
+
+    def get(self, name, default=None):
+        """Get an item from the backend."""
+
+        item = self.backend.get(self.key(name))
+        if item is None:
+            return default
+        if isinstance(item, CachedGrade):
+            return CachedGrade(hydrate(item.result), item.time, item.inputs)
+        return item
+
+    def __getitem__(self, name):
+        """Get an item, raising if it is missing."""
+
+        item = self.get(name)
+        if item is None:
+            raise KeyError(name)
+        return item
+
+    def __setitem__(self, name, item):
+        """Store an item in the backend indefinitely."""
+
+        if isinstance(item, CachedGrade):
+            item = CachedGrade(dehydrate(item.result), item.time, item.inputs)
+        self.backend.set(self.key(name), item, None)
+
+    def __contains__(self, name):
+        """Check whether an item is in the backend."""
+
+        return self.backend.get(self.key(name)) is not None
+
+    def add(self, name, item, timeout: int=None) -> bool:
+        """Store an item only if it is not already present.
+
+        The file based backend checks and writes in separate steps, so
+        adds to it are serialized by an exclusive lock on a file in the
+        cache directory. Other backends add atomically on their own.
+        """
+
+        backend = self.backend
+        if not isinstance(backend, FileBasedCache):
+            return backend.add(self.key(name), item, timeout)
+        with open(os.path.join(backend._dir, CLAIMS_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            return backend.add(self.key(name), item, timeout)
+
+    def __delitem__(self, name):
+        """Remove an item from the backend."""
+
+        self.backend.delete(self.key(name))
+
+    def scoped(self, scope):
+        """Get a container for the results of a single competition.
+
+        Scoped containers share the dependencies declared on this one,
+        so the results written to them record the changes they were
+        computed from, and invalidation reaches every competition
+        without knowing which containers were scoped.
+        """
+
+        scoped = SCOPES.get((id(self), scope))
+        if scoped is None:
+            scoped = GraderCache("{}:{}".format(self.prefix, scope), self.alias)
+            _, names = DEPENDENCIES.setdefault(id(self), (self, {}))
+            DEPENDENCIES[id(scoped)] = (scoped, names)
+            scoped = SCOPES.setdefault((id(self), scope), scoped)
+        return scoped
+
+
+def scope_cache(cache, args):
+    """Get the container a cached grader method stores its results in.
+
+    Methods of a competition grader cache their results per competition
+    so that several competitions can be graded side by side. Anything
+    else, including plain dictionaries, uses the container as is.
+    """
+
+    if isinstance(cache, GraderCache) and args and isinstance(args[0], CompetitionGrader):
+        return cache.scoped(args[0].competition.id)
+    return cache
+
+
+def depends(cache, name, dependencies):
+    """Declare what a cached name depends on.
+
+    Dependencies are either other cached names in the same container,
+    `(ROUND, ref)` pairs for the answers and questions of a round, or
+    `ATTENDANCE` for student attendance.
+    """
+
+    _, names = DEPENDENCIES.setdefault(id(cache), (cache, {}))
+    names.setdefault(name, set()).update(dependencies)
 
 
-def cache_set(cache, name, result):
+def inputs(cache, name) -> set:
+    """Get everything a cached name depends on, transitively."""
+
+    names = DEPENDENCIES.get(id(cache), (cache, {}))[1]
+    found, pending = set(), [name]
+    while pending:
+        for dependency in names.get(pending.pop(), ()):
+            if dependency not in found:
+                found.add(dependency)
+                pending.append(dependency)
+    return found
+
+
+def _change_key(change) -> str:
+    """Get the backend key of the stamp of a change."""
+
+    if isinstance(change, tuple):
+        change = ":".join(map(str, change))
+    return CHANGED.format(change)
+
+
+def changes_backend():
+    """Get the backend change stamps are shared through."""
+
+    return caches[getattr(settings, "GRADER_CACHE", "default")]
+
+
+def last_changed(changes) -> float:
+    """Get when any of the changes last happened, or zero if never."""
+
+    if not changes:
+        return 0
+    return max(changes_backend().get_many([_change_key(change) for change in changes]).values(), default=0)
+
+
+def invalidate(*changes):
+    """Mark every cached result that depends on any of the changes stale.
+
+    Each change is stamped in the shared grader cache backend, and
+    results compare the stamps of the changes they were computed from,
+    including those of other cached names they were computed from, when
+    they are read. Invalidation therefore reaches results written by
+    any process, whichever grader modules this one has imported. Stale
+    results are kept so they can still be served while a replacement is
+    computed, see `cached`.
+    """
+
+    now = time.time()
+    changes_backend().set_many({_change_key(change): now for change in changes}, None)
+
+
+def after_commit(function, *args, **kwargs):
+    """Call a function once the current transaction commits.
+
+    Grades invalidated before the changes behind them are committed
+    could be recomputed from the old data and cached as fresh, so
+    invalidation waits for the commit. Outside of a transaction the
+    function is called immediately.
+    """
+
+    transaction.on_commit(functools.partial(function, *args, **kwargs))
+
+
+def is_fresh(cache, name, item: CachedGrade) -> bool:
+    """Check whether a cached item was computed after its inputs last changed."""
+
+    return item is not None and item.time > last_changed(item.inputs)
+
+
+def claim(cache, name, timeout: int=COMPUTE_TIMEOUT) -> bool:
+    """Claim the recomputation of a cached name.
+
+    Only one caller, across all processes sharing a grader cache, can
+    hold the claim at a time. Claims expire after the timeout in case
+    their holder dies before releasing them.
+    """
+
+    if isinstance(cache, GraderCache):
+        return cache.add(name + COMPUTING, time.time(), timeout)
+    with CLAIMS_LOCK:
+        claimed = cache.get(name + COMPUTING)
+        if claimed is not None and claimed > time.time() - timeout:
+            return False
+        cache[name + COMPUTING] = time.time()
+        return True
+
+
+def release(cache, name):
+    """Release the claim on the recomputation of a cached name."""
+
+    if name + COMPUTING in cache:
+        del cache[name + COMPUTING]
+
+
+def cache_version(cache, name):
+    """Get a stamp that changes whenever a cached output is replaced or invalidated.
+
+    Outputs are stored along with a small key holding when they were
+    computed and from what, so unlike reading the output itself, this
+    never loads the output or touches the database.
+    """
+
+    version = cache.get(name + VERSION)
+    if version is None:
+        return None, 0
+    when, inputs = version
+    return when, last_changed(inputs)
+
+
+def fresh_names(cache, names) -> set:
+    """Get which cached names hold fresh outputs without loading them.
+
+    The version keys of every name are read at once, followed by the
+    stamps of every change they were computed from, see `cache_version`.
+    """
+
+    keys = {name: name + VERSION for name in names}
+    if isinstance(cache, GraderCache):
+        found = cache.backend.get_many([cache.key(key) for key in keys.values()])
+        versions = {name: found[cache.key(key)] for name, key in keys.items() if cache.key(key) in found}
+    else:
+        versions = {name: cache[key] for name, key in keys.items() if key in cache}
+
+    changes = {change for when, inputs in versions.values() for change in inputs}
+    stamps = changes_backend().get_many([_change_key(change) for change in changes]) if changes else {}
+    return {name for name, (when, inputs) in versions.items()
+            if when > max((stamps.get(_change_key(change), 0) for change in inputs), default=0)}
+
+
+def cache_set(cache, name, result, depends_on=()):
     """Set an item in the cache manually."""
 
-    cache[name] = CachedGrade(result, time.time())
+    if depends_on:
+        depends(cache, name, depends_on)
+    item = cache[name] = CachedGrade(result, time.time(), inputs(cache, name))
+    cache[name + VERSION] = (item.time, item.inputs)
 
 
 def cache_get(cache, name):
-    """Get an item from the cache."""
+    """Get an item from the cache if it is not stale."""
 
     item = cache.get(name)
-    return None if item is None else item.result
+    return item.result if is_fresh(cache, name, item) else None
 
 
-def cached(cache: dict, name: object):
+def cached(cache: dict, name: object, depends_on=()):
     """Decorator that caches the return of a function.
 
     Intended as a quick way to save on computation. Since decorators
@@ -64,30 +451,309 @@ def cached(cache: dict, name: object):
     provide a global caching mechanism, `use_cache_before` can be set
     instead, which uses the cached value until a number of seconds
     since the last recalculation.
+
+    The cached output is stale whenever something it depends on is
+    invalidated, see `invalidate`. A result whose dependencies changed
+    while it was being computed is returned but not cached.
+
+    Callers that would rather be fast than current can pass `use_stale`,
+    in which case a stale output is returned immediately while a single
+    caller recomputes it in the background. Setting `refresh_ahead`
+    along with `use_cache_before` also starts that recomputation the
+    given number of seconds before the cached output would expire.
+
+    Methods of a competition grader are also memoized by a checksum of
+    their inputs, see `CompetitionGrader.input_checksum`. Recomputing a
+    stale output whose inputs have not changed since it was last
+    computed restores that output instead, as long as the cached
+    outputs it depends on are fresh. Otherwise the function runs and
+    recomputes or restores those outputs as it reads them. Turning
+    `use_cache` off always runs the function, which is how a stale
+    output can be repaired by hand.
+
+    The decorated function also gets a `version` attribute that returns
+    a cheap stamp of the cached output, see `cache_version`.
     """
 
+    depends(cache, name, depends_on)
+    container = cache
+
     def decorator(function):
-        def wrapper(*args, use_cache: bool=True, use_cache_before: int=0, **kwargs):
+        def wrapper(*args, use_cache: bool=True, use_cache_before: int=0,
+                    use_stale: bool=False, refresh_ahead: int=0, **kwargs):
+
+            if "use_cache" in function.__code__.co_varnames:
+                kwargs["use_cache"] = use_cache
+            cache = scope_cache(container, args)
+            grader = args[0] if cache is not container else None
+
+            def compute(use_memo: bool=True):
+                start = time.time()
+                names = DEPENDENCIES[id(container)][1]
+                checksum = grader.input_checksum(name, names) if grader else None
+                if checksum is not None and use_memo:
+                    memo = cache.get(name + MEMO)
+                    upstream = [dependency for dependency in inputs(cache, name) if dependency in names]
+                    if memo is not None and memo.result["checksum"] == checksum \
+                            and len(fresh_names(cache, upstream)) == len(upstream):
+                        outputs = memo.result["outputs"]
+                        if last_changed(inputs(cache, name)) < start:
+                            for output, result in outputs.items():
+                                cache_set(cache, output, result)
+                        return outputs[name]
+
+                result = function(*args, **kwargs)
+                if last_changed(inputs(cache, name)) < start:
+                    cache_set(cache, name, result)
+                    if checksum is not None:
+                        memoize(grader, cache, name, result, checksum, start)
+                return result
+
+            def refresh():
+                if claim(cache, name):
+                    threading.Thread(target=_refresh, args=(cache, name, compute), daemon=True).start()
+
+            item = cache.get(name) if use_cache or use_cache_before > 0 or use_stale else None
+            fresh = is_fresh(cache, name, item)
 
             # Use cache time before normal cache
-            if use_cache_before > 0 and name in cache:
-                if cache[name].time >= time.time() - use_cache_before:
-                    return cache_get(cache, name)
+            if use_cache_before > 0 and fresh:
+                age = time.time() - item.time
+                if age <= use_cache_before:
+                    if refresh_ahead > 0 and age > use_cache_before - refresh_ahead:
+                        refresh()
+                    return item.result
 
             # Then check cache normally, only if use_cache_before is 0
-            elif use_cache and name in cache:
-                return cache_get(cache, name)
+            elif use_cache and fresh:
+                return item.result
+
+            # Serve the stale output while one caller replaces it
+            if use_stale and item is not None:
+                refresh()
+                return item.result
+
+            return compute(use_memo=use_cache)
+
+        return CachedFunction(wrapper, lambda *args: cache_version(scope_cache(container, args), name))
+    return decorator
+
+
+def memoize(grader, cache, name, result, checksum: str, start: float):
+    """Remember an output by the checksum of its inputs.
+
+    Outputs the grader wrote while computing it that depend on it, such
+    as raw scores, are remembered along with it so that they are also
+    restored when the checksum matches again.
+    """
+
+    _, names = DEPENDENCIES[id(cache)]
+    outputs = {name: result}
+    for dependent, (written, output) in list(grader.written.items()):
+        if written >= start and name in names.get(dependent, ()):
+            outputs[dependent] = output
+    cache[name + MEMO] = CachedGrade({"checksum": checksum, "outputs": outputs})
+
+
+def answer_checksum(answer: models.Answer, value) -> int:
+    """Hash an answer with a value into a term of its round checksum.
+
+    Blank answers hash to zero, so creating or deleting them leaves the
+    checksum alone. Hashes are 40 bits so that sums of them over even
+    millions of answers fit in the checksum column.
+    """
+
+    if value is None:
+        return 0
+    key = "{}:{}:{}:{!r}".format(answer.question_id, answer.student_id, answer.team_id, float(value))
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=5).digest(), "big")
+
+
+def source_checksum(module: str) -> str:
+    """Get a checksum of the source of a grader module."""
+
+    if module not in SOURCES:
+        try:
+            source = inspect.getsource(importlib.import_module(module))
+        except (OSError, TypeError):
+            source = module
+        SOURCES[module] = hashlib.sha1(source.encode()).hexdigest()
+    return SOURCES[module]
 
-            if "use_cache" in function.__code__.co_varnames:
-                kwargs["use_cache"] = use_cache
 
-            result = function(*args, **kwargs)
-            cache_set(cache, name, result)
-            return result
-        return wrapper
+class CachedFunction:
+    """A function wrapped by `cached` that binds to instances like one.
+
+    Bound or not, it has a `version` method that takes the same leading
+    arguments and returns a cheap stamp of the cached output.
+    """
+
+    def __init__(self, function, version):
+        """Wrap a cached function and its version stamp."""
+
+        self.function = function
+        self.version = version
+        functools.update_wrapper(self, function)
+
+    def __call__(self, *args, **kwargs):
+        """Call the cached function."""
+
+        return self.function(*args, **kwargs)
+
+    def __get__(self, instance, owner):
+        """Bind the function and its version to an instance."""
+
+        if instance is None:
+            return self
+        bound = functools.partial(self.function, instance)
+        bound.version = functools.partial(self.version, instance)
+        return bound
+
+
+def _refresh(cache, name, compute):
+    """Recompute a cached output in a background thread."""
+
+    try:
+        compute()
+    finally:
+        release(cache, name)
+        connections.close_all()
+
+
+def vectorized(column_grader):
+    """Decorator that declares a column equivalent of a question grader.
+
+    The column grader is called like a method of the competition grader
+    with the question, the column of answer values as a float array
+    with NaN for blank or missing answers, and the answer matrix the
+    column belongs to. It should return the grades of the entire column
+    or None if the column cannot be vectorized, in which case each
+    answer is passed to the question grader individually.
+    """
+
+    def decorator(function):
+        function.column_grader = column_grader
+        return function
     return decorator
 
 
+def solve_power_averages(score_sets, target: float, tol: float=0.0001, maxiter: int=1000):
+    """Find the exponents that bring power averages of scores to a target.
+
+    For each list of scores in (0, 1], with zeros excluded from the sum
+    but not from the count, solves mean(score ** d) = target for d. The
+    lists are padded into a single array and solved together with the
+    secant iteration scipy's newton uses without a derivative, starting
+    from one, so results agree with solving each list separately. Lists
+    the iteration cannot solve are passed to scipy individually, which
+    raises just as it would have.
+    """
+
+    score_sets = [list(scores) for scores in score_sets]
+    if not score_sets:
+        return []
+
+    width = max(len(scores) for scores in score_sets)
+    scores = numpy.ones((len(score_sets), width))
+    present = numpy.zeros(scores.shape, dtype=bool)
+    for i, row in enumerate(score_sets):
+        scores[i, :len(row)] = row
+        present[i, :len(row)] = numpy.array(row) != 0
+    scores[~present] = 1
+    counts = numpy.array([len(row) for row in score_sets], dtype=float)
+
+    def power_average(d, rows):
+        powers = numpy.where(present[rows], numpy.power(scores[rows], d[:, None]), 0)
+        return target - powers.sum(axis=1) / counts[rows]
+
+    # Same starting points and termination as scipy.optimize.newton
+    everything = numpy.arange(len(score_sets))
+    p0 = numpy.ones(len(score_sets))
+    p1 = p0 * (1 + 1e-4) + 1e-4
+    q0 = power_average(p0, everything)
+    q1 = power_average(p1, everything)
+    swap = numpy.abs(q1) < numpy.abs(q0)
+    p0[swap], p1[swap] = p1[swap], p0[swap]
+    q0[swap], q1[swap] = q1[swap], q0[swap]
+
+    results = numpy.full(len(score_sets), numpy.nan)
+    active = everything
+    with numpy.errstate(all="ignore"):
+        for _ in range(maxiter):
+            if not len(active):
+                break
+
+            # Flat secants are left to scipy, which reports them
+            flat = q1[active] == q0[active]
+            active = active[~flat]
+
+            a0, a1, b0, b1 = p0[active], p1[active], q0[active], q1[active]
+            p = numpy.where(
+                numpy.abs(b1) > numpy.abs(b0),
+                (-b0 / b1 * a1 + a0) / (1 - b0 / b1),
+                (-b1 / b0 * a0 + a1) / (1 - b1 / b0))
+            done = numpy.abs(p - a1) <= tol
+            results[active[done]] = p[done]
+
+            active, p = active[~done], p[~done]
+            p0[active], q0[active] = p1[active], q1[active]
+            p1[active] = p
+            q1[active] = power_average(p, active)
+
+    # Fall back to the scalar solver wherever the iteration failed
+    output = results.tolist()
+    for i in numpy.flatnonzero(~numpy.isfinite(results)):
+        output[i] = _solve_power_average(score_sets[i], target, tol, maxiter)
+    return output
+
+
+def _solve_power_average(scores, target: float, tol: float, maxiter: int):
+    """Find the exponent for a single list of scores with scipy."""
+
+    import scipy.optimize
+
+    def power_average(d):
+        return target - 1.0/len(scores) * sum(pow(score, d) for score in scores if score != 0)
+    return scipy.optimize.newton(power_average, 1, tol=tol, maxiter=maxiter)
+
+
+def process_pool() -> ProcessPoolExecutor:
+    """Get the pool of worker processes, starting it on first use."""
+
+    with POOL_LOCK:
+        if not POOL:
+            POOL.append(ProcessPoolExecutor(max_workers=PROCESSES))
+        return POOL[0]
+
+
+def map_divisions(function, work: dict) -> dict:
+    """Apply a function to independent pieces of work, such as divisions.
+
+    Work maps keys to tuples of arguments, which like the function must
+    be picklable, so plain arrays and module level functions. With more
+    than one of `PROCESSES`, pieces are run in the worker processes.
+    Results are merged in the order of the work rather than the order
+    they finish in, so the output does not depend on the pool.
+    """
+
+    if PROCESSES < 2 or len(work) < 2:
+        return collections.OrderedDict((key, function(*args)) for key, args in work.items())
+    pool = process_pool()
+    futures = [(key, pool.submit(function, *args)) for key, args in work.items()]
+    return collections.OrderedDict((key, future.result()) for key, future in futures)
+
+
+def standardize(data: numpy.ndarray) -> numpy.ndarray:
+    """Standardize scores by their mean and sample standard deviation.
+
+    Every score is zero where the deviation is zero or there are fewer
+    than two scores.
+    """
+
+    dev = data.std(ddof=1) if len(data) > 1 else 0
+    return numpy.zeros(len(data)) if dev == 0 else (data - data.mean()) / dev
+
+
 class ChillDictionary(dict):
     """Dictionary that sets empty keys to chill dictionaries."""
 
@@ -118,6 +784,250 @@ class ChillDictionary(dict):
         return out
 
 
+class AnswerMatrix:
+    """Every answer to a round, loaded with a single query.
+
+    Answers are indexed by the id of the student or team that submitted
+    them and then by question number. Students, teams, and the team of
+    each student are joined in the same query, so question graders can
+    dereference divisions and subjects without going back to the
+    database.
+    """
+
+    def __init__(self, round: models.Round, questions=None):
+        """Load the answers to a round."""
+
+        self.round = round
+        self.group = GROUPS.get(round.grouping)
+        self.questions = list(questions if questions is not None else round.questions.order_by("number"))
+        self.answers = {}
+
+        if self.group is None:
+            self._array()
+            return
+
+        questions_by_id = {question.id: question for question in self.questions}
+        query = models.Answer.objects.filter(
+            question__round=round, **{self.group + "__isnull": False}).select_related(*RELATED[self.group])
+        for answer in query:
+            answer.question = questions_by_id[answer.question_id]
+            thing_id = getattr(answer, self.group + "_id")
+            self.answers.setdefault(thing_id, {})[answer.question.number] = answer
+
+        self._array()
+
+    def _array(self):
+        """Lay the answers out as a float array of things by questions."""
+
+        self.ids = sorted(self.answers)
+        self.index = {thing_id: i for i, thing_id in enumerate(self.ids)}
+        self.things = []
+        self.values = numpy.full((len(self.ids), len(self.questions)), numpy.nan)
+        self.present = numpy.zeros(self.values.shape, dtype=bool)
+        self.weights = numpy.array([question.weight for question in self.questions], dtype=float)
+        self._groups = {}
+
+        columns = {question.number: j for j, question in enumerate(self.questions)}
+        for i, thing_id in enumerate(self.ids):
+            row = self.answers[thing_id]
+            self.things.append(getattr(next(iter(row.values())), self.group))
+            for number, answer in row.items():
+                j = columns[number]
+                self.present[i, j] = True
+                if answer.value is not None:
+                    self.values[i, j] = answer.value
+
+    @property
+    def shape(self):
+        """Get the shape of the answer array."""
+
+        return len(self.ids), len(self.questions)
+
+    def rows_by(self, *attributes):
+        """Group row indices by attributes of the student or team.
+
+        Attributes may be dotted, such as `team.division`. The result
+        maps the attribute value, or a tuple of values when there are
+        several, to an array of row indices.
+        """
+
+        if attributes not in self._groups:
+            getter = operator.attrgetter(*attributes)
+            groups = {}
+            for i, thing in enumerate(self.things):
+                groups.setdefault(getter(thing), []).append(i)
+            self._groups[attributes] = {key: numpy.array(rows) for key, rows in groups.items()}
+        return self._groups[attributes]
+
+    def get(self, thing_id, number):
+        """Get the answer of a student or team to a question number."""
+
+        return self.answers.get(thing_id, {}).get(number)
+
+    def row(self, thing_id):
+        """Get all answers of a student or team by question number."""
+
+        return self.answers.get(thing_id, {})
+
+
+def save_answers(round: models.Round, values):
+    """Write answer values to a round in bulk.
+
+    Values are pairs of an answer, which may be unsaved, and its new
+    value. New answers are inserted with a single query and changed ones
+    are updated with a query per distinct value, all in a transaction.
+    Bulk writes send no signals, so running totals and cached grades are
+    updated here instead. Returns the number of answers written.
+    """
+
+    changes = []
+    created = []
+    updated = {}
+    for answer, value in values:
+        if answer.pk is None:
+            created.append(answer)
+        elif answer.value != value:
+            updated.setdefault(value, []).append(answer.pk)
+        else:
+            continue
+        changes.append((answer, answer.value if answer.pk else None))
+        answer.value = value
+
+    if not changes:
+        return 0
+
+    with transaction.atomic():
+        models.Answer.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        for value, ids in updated.items():
+            for i in range(0, len(ids), BATCH_SIZE):
+                models.Answer.objects.filter(id__in=ids[i:i+BATCH_SIZE]).update(value=value)
+        answers_changed(round, changes)
+
+    return len(changes)
+
+
+@transaction.atomic
+def answers_changed(round: models.Round, changes):
+    """Update running totals and invalidate grades after answers changed.
+
+    Changes are pairs of an answer and its previous value, as taken by
+    `CompetitionGrader.apply_answer_changes`. The statistics of every
+    question with a changed answer are recounted as well, the checksum
+    of the round is adjusted, and the answer version of the competition
+    is bumped. Totals, statistics, and the checksum are written in the
+    transaction of the answers, or in one of their own for answers saved
+    one at a time, while the answer version and grades are only bumped
+    and invalidated once it commits.
+    """
+
+    # The round is locked by its checksum before totals are adjusted,
+    # see `CompetitionGrader.verify_running_totals`
+    competition = round.competition
+    delta = sum(answer_checksum(answer, answer.value) - answer_checksum(answer, previous)
+                for answer, previous in changes)
+    if delta:
+        models.Round.objects.filter(id=round.id).update(checksum=F("checksum") + delta)
+    if competition._grader and changes and round.ref in competition.grader.RUNNING_TOTALS:
+        for answer, previous in changes:
+            answer.question.round = round
+        competition.grader.apply_answer_changes(changes)
+    statistics.refresh_question_statistics({answer.question_id for answer, previous in changes})
+    if changes:
+        after_commit(answer_set_changed, id=round.competition_id)
+    after_commit(invalidate, (ROUND, round.ref))
+
+
+def answer_set_changed(**lookup):
+    """Bump the answer version of the competitions matching a lookup.
+
+    Scoreboard snapshots are keyed by the answer version, so anything
+    that changes grades, including questions and attendance, bumps it.
+    """
+
+    models.Competition.objects.filter(**lookup).update(answer_version=F("answer_version") + 1)
+
+
+class RoundPlan:
+    """The questions of a round in order with their resolved graders.
+
+    Question ids, weights, types, and answers are laid out as arrays in
+    the same order as the questions, which is also the column order of
+    an answer matrix of the round.
+    """
+
+    def __init__(self, round: models.Round, questions, graders):
+        """Lay out the compiled questions of a round."""
+
+        self.round = round
+        self.questions = questions
+        self.graders = graders
+        self.ids = numpy.array([question.id for question in questions], dtype=int)
+        self.weights = numpy.array([question.weight for question in questions], dtype=float)
+        self.types = numpy.array([question.type for question in questions], dtype=int)
+        self.answers = numpy.array(
+            [numpy.nan if question.answer is None else question.answer for question in questions], dtype=float)
+
+    def __iter__(self):
+        """Iterate pairs of questions and their graders."""
+
+        return zip(self.questions, self.graders)
+
+
+class GraderPlan:
+    """Every question and round of a competition resolved to its grader.
+
+    Registrations are matched against the competition once, with a query
+    for the rounds and questions and one per registration. Where several
+    registrations match the same question or round with different
+    functions the last one wins, as it always has, but the overlap is
+    logged and kept in conflicts, which maps each contested question or
+    round to the names of the functions that matched it.
+    """
+
+    def __init__(self, grader):
+        """Compile the registrations of a competition grader."""
+
+        competition = grader.competition
+        self.rounds = {}
+        self.question_graders = {}
+        self.round_graders = {}
+        self.conflicts = {}
+
+        rounds = {round.id: round for round in competition.rounds.all()}
+        for query, function in grader.round_registrations:
+            for round_id in models.Round.objects.filter(query, competition=competition).values_list("id", flat=True):
+                self._resolve(self.round_graders, rounds[round_id], round_id, function)
+
+        questions = list(models.Question.objects.filter(round__competition=competition).order_by("number"))
+        by_id = {question.id: question for question in questions}
+        for query, function in grader.question_registrations:
+            for question_id in models.Question.objects.filter(
+                    query, round__competition=competition).values_list("id", flat=True):
+                self._resolve(self.question_graders, by_id[question_id], question_id, function)
+
+        for conflict, names in self.conflicts.items():
+            logger.warning("Graders %s all registered to %r of %s", ", ".join(names), conflict, competition)
+
+        by_round = {}
+        for question in questions:
+            question.round = rounds[question.round_id]
+            by_round.setdefault(question.round_id, []).append(question)
+        for round_id, round in rounds.items():
+            round_questions = by_round.get(round_id, [])
+            graders = [self.question_graders.get(question.id, grader.default_question_grader)
+                       for question in round_questions]
+            self.rounds[round_id] = RoundPlan(round, round_questions, graders)
+
+    def _resolve(self, graders: dict, target, key: int, function):
+        """Assign a function to a question or round, noting conflicts."""
+
+        previous = graders.get(key)
+        if previous is not None and previous != function:
+            names = self.conflicts.setdefault(target, [previous.__name__])
+            names.append(function.__name__)
+        graders[key] = function
+
+
 class CompetitionGrader:
     """Base class for a competition grader.
 
@@ -126,14 +1036,24 @@ class CompetitionGrader:
     in the model declaration.
     """
 
-    cache = {}
+    cache = GraderCache("grader")
+
+    # Whether to grade columns with vectorized question graders
+    VECTORIZE = True
+
+    # Round refs whose totals are adjusted as answers change
+    RUNNING_TOTALS = ()
 
     def __init__(self, competition: models.Competition):
         """Initialize the competition grader."""
 
         self.competition = competition
-        self.question_graders = {}
-        self.round_graders = {}
+        self.question_registrations = []
+        self.round_registrations = []
+        self._plan = None
+
+        # Outputs last written with cache_set as (time, output) by name
+        self.written = {}
 
     ################
     # Cache access #
@@ -142,101 +1062,305 @@ class CompetitionGrader:
     def cache_get(self, name):
         """Get an item from the cache."""
 
-        return cache_get(self.cache, name)
+        return cache_get(scope_cache(self.cache, (self,)), name)
 
-    def cache_set(self, name, result):
+    def cache_set(self, name, result, depends_on=()):
         """Set an item in the cache."""
 
-        cache_set(self.cache, name, result)
+        self.written[name] = (time.time(), result)
+        cache_set(scope_cache(self.cache, (self,)), name, result, depends_on)
+
+    def input_checksum(self, name, names: dict) -> str:
+        """Checksum everything a cached output is computed from.
+
+        Dependencies of the output are followed through other cached
+        names to the rounds and attendance it depends on. The checksum
+        covers the answers of those rounds, their compiled questions,
+        the attending students with their divisions and subjects if
+        attendance is involved, the teams of the competition with their
+        divisions if a team round is involved, since team scores are
+        grouped by them, and the source of the grader module.
+        """
+
+        refs, attendance = set(), False
+        pending, seen = [name], set()
+        while pending:
+            for dependency in names.get(pending.pop(), ()):
+                if dependency in seen:
+                    continue
+                seen.add(dependency)
+                if dependency == ATTENDANCE:
+                    attendance = True
+                elif isinstance(dependency, tuple) and dependency[0] == ROUND:
+                    refs.add(dependency[1])
+                else:
+                    pending.append(dependency)
+
+        digest = hashlib.sha1(source_checksum(type(self).__module__).encode())
+        digest.update(repr(structure_version(self.competition.id)).encode())
+        rounds = self.competition.rounds.filter(ref__in=refs).order_by("ref").values_list(
+            "id", "ref", "checksum", "grouping")
+        team_rounds = False
+        for id, ref, checksum, grouping in rounds:
+            team_rounds |= grouping == models.TEAM
+            digest.update("{}:{}".format(ref, checksum).encode())
+            round_plan = self.plan.rounds.get(id)
+            if round_plan is not None:
+                for array in (round_plan.ids, round_plan.weights, round_plan.types, round_plan.answers):
+                    digest.update(array.tobytes())
+        if attendance:
+            students = coaches.models.Student.objects.filter(team__competition=self.competition, attending=True)
+            for row in students.order_by("id").values_list("id", "team__division", "subject1", "subject2"):
+                digest.update(repr(row).encode())
+        if team_rounds:
+            teams = coaches.models.Team.objects.filter(competition=self.competition).order_by("id")
+            digest.update(repr(list(teams.values_list("id", "division"))).encode())
+        return digest.hexdigest()
 
     ####################
     # Question graders #
     ####################
 
+    def default_column_grader(self, question: models.Question, values: numpy.ndarray, answers: AnswerMatrix):
+        """Default action for grading a column of answers."""
+
+        return question.weight * numpy.nan_to_num(values)
+
+    @vectorized(default_column_grader)
     def default_question_grader(self, question: models.Question, answer: models.Answer):
         """Default action for grading a question."""
 
         return question.weight * (answer.value or 0)
 
-    def default_round_grader(self, round: models.Round):
+    def default_round_grader(self, round: models.Round, answers: AnswerMatrix=None):
         """Default action for grading a round."""
 
         if round.grouping == models.ROUND_GROUPINGS["individual"]:
-            model = coaches.models.Student
-            group = "student"
+            things = coaches.models.Student.objects.filter(
+                team__competition=self.competition, attending=True).select_related("team")
         elif round.grouping == models.ROUND_GROUPINGS["team"]:
-            model = coaches.models.Team
-            group = "team"
+            things = coaches.models.Team.objects.filter(competition=self.competition)
         else:
             return None
 
+        answers = answers or self.load_answers(round)
+        totals = self.grade_answers(answers).sum(axis=1)
+
         # Iterate through teams or students
         scores = ChillDictionary()
         for division in coaches.models.DIVISIONS_MAP:
             scores[division] = ChillDictionary()
 
-        for thing in model.current():
-
-            if group == "student" and not thing.attending:
-                continue
-
-            score = 0
-            for question in round.questions.all():
-                answer = models.Answer.objects.filter(**{group: thing}, question=question).first()
-                if answer:
-                    result = self.get_question_grader(question)(question, answer)
-                    score += result or 0
+        for thing in things:
 
             # Separate by division
-            division = None
-            if group == "student":
-                division = thing.team.division
-            elif group == "team":
-                division = thing.division
+            division = thing.team.division if answers.group == "student" else thing.division
 
             # Save score
-            scores[division][thing] = score
+            i = answers.index.get(thing.id)
+            scores[division][thing] = 0 if i is None else float(totals[i])
+
+        return scores
+
+    ###################
+    # Answer matrices #
+    ###################
+
+    def load_answers(self, round: models.Round):
+        """Load every answer to a round in a single query."""
+
+        plan = self.plan.rounds.get(round.id)
+        return AnswerMatrix(round, plan.questions if plan is not None else None)
+
+    def grade_answers(self, answers: AnswerMatrix):
+        """Grade a loaded round into an array of things by questions.
+
+        Columns whose question grader declares a vectorized equivalent
+        are graded in a single array operation. The rest are graded one
+        answer at a time. Missing answers are always worth zero.
+        """
+
+        grades = numpy.zeros(answers.shape)
+        plan = self.plan.rounds.get(answers.round.id)
+        if plan is not None and plan.questions == answers.questions:
+            graders = plan.graders
+        else:
+            graders = [self.get_question_grader(question) for question in answers.questions]
+
+        for j, (question, grader) in enumerate(zip(answers.questions, graders)):
+
+            column = None
+            if self.VECTORIZE and hasattr(grader, "column_grader"):
+                column = grader.column_grader(self, question, answers.values[:, j], answers)
+
+            if column is None:
+                column = numpy.zeros(len(answers.ids))
+                for i, thing_id in enumerate(answers.ids):
+                    answer = answers.get(thing_id, question.number)
+                    if answer:
+                        column[i] = grader(question, answer) or 0
+
+            grades[:, j] = numpy.where(answers.present[:, j], column, 0)
+        return grades
+
+    ##################
+    # Running totals #
+    ##################
 
+    def apply_answer_changes(self, changes):
+        """Adjust running totals for answers whose values changed.
+
+        Changes are pairs of a saved answer, with its question loaded,
+        and its previous value, which is None for new answers. Only
+        rounds listed in `RUNNING_TOTALS` are maintained. A total that
+        does not exist yet is rebuilt from the saved answers, which
+        already include every change, so later changes to the same team
+        or student are skipped.
+        """
+
+        rebuilt = set()
+        for answer, previous in changes:
+            round = answer.question.round
+            if round.ref not in self.RUNNING_TOTALS:
+                continue
+
+            grader = self.get_question_grader(answer.question)
+            before = copy.copy(answer)
+            before.value = previous
+            delta = (grader(answer.question, answer) or 0) - (grader(answer.question, before) or 0)
+            if delta == 0:
+                continue
+
+            group = GROUPS[round.grouping]
+            thing = {group + "_id": getattr(answer, group + "_id")}
+            key = (round.id, group, thing[group + "_id"])
+            if key in rebuilt:
+                continue
+            if not models.RoundTotal.objects.filter(round=round, **thing).update(value=F("value") + delta):
+                self._rebuild_running_total(round, group, thing)
+                rebuilt.add(key)
+
+    def _rebuild_running_total(self, round: models.Round, group: str, thing: dict):
+        """Create the running total of a single team or student from scratch."""
+
+        value = 0
+        for answer in models.Answer.objects.filter(question__round=round, **thing).select_related(
+                "question", *RELATED[group]):
+            value += self.get_question_grader(answer.question)(answer.question, answer) or 0
+        models.RoundTotal.objects.update_or_create(round=round, **thing, defaults={"value": value})
+
+    def running_totals(self, round: models.Round):
+        """Read the running totals of a round, grouped like grade_round."""
+
+        group = GROUPS[round.grouping]
+        totals = dict(models.RoundTotal.objects.filter(round=round).values_list(group + "_id", "value"))
+        if group == "student":
+            things = coaches.models.Student.objects.filter(
+                team__competition=self.competition, attending=True).select_related("team")
+        else:
+            things = coaches.models.Team.objects.filter(competition=self.competition)
+
+        scores = ChillDictionary()
+        for division in coaches.models.DIVISIONS_MAP:
+            scores[division] = ChillDictionary()
+        for thing in things:
+            division = thing.team.division if group == "student" else thing.division
+            scores[division][thing] = totals.get(thing.id, 0)
         return scores
 
+    def verify_running_totals(self, round: models.Round, scores=None):
+        """Regrade a round and correct its running totals.
+
+        The round row is locked while totals are compared, which answer
+        changes also lock to adjust the round checksum before totals, so
+        no change is applied between grading and correcting. Scores that
+        are passed in are only used if the checksum of the round has not
+        changed since it was loaded, otherwise the round is regraded.
+
+        Returns the teams or students whose running total had drifted
+        from the regraded score, mapped to the stored and correct values.
+        Totals that were never set up are created without counting as
+        drift, so the first verification of a round reports nothing.
+        """
+
+        group = GROUPS[round.grouping]
+        with transaction.atomic():
+            checksum = models.Round.objects.select_for_update().filter(
+                id=round.id).values_list("checksum", flat=True).first()
+            if not scores or checksum != round.checksum:
+                scores = self.grade_round(round)
+            stored = dict(models.RoundTotal.objects.filter(round=round).values_list(group + "_id", "value"))
+
+            drift = {}
+            missing = []
+            for division in scores:
+                for thing, score in scores[division].items():
+                    if thing.id not in stored:
+                        missing.append(models.RoundTotal(round=round, value=score, **{group: thing}))
+                    elif abs(stored[thing.id] - score) > 1e-9:
+                        models.RoundTotal.objects.filter(round=round, **{group: thing}).update(value=score)
+                        drift[thing] = (stored[thing.id], score)
+
+            models.RoundTotal.objects.bulk_create(missing)
+            graded = {thing.id for division in scores for thing in scores[division]}
+            models.RoundTotal.objects.filter(round=round).exclude(**{group + "_id__in": graded}).delete()
+
+        if drift:
+            logger.warning("Running totals of %s drifted for %d: %s", round.ref, len(drift), drift)
+        return drift
+
     #######################
     # Grader registration #
     #######################
 
     def register_question_grader(self, query: Q, function):
-        """Register a question grading function to a set of questions."""
+        """Register a question grading function to a set of questions.
 
-        for question in models.Question.objects.filter(query, round__competition=self.competition).all():
-            self.question_graders[question.id] = function
+        Registrations are only matched against questions when the plan
+        is compiled, so later registrations still take precedence.
+        """
+
+        self.question_registrations.append((query, function))
+        self._plan = None
 
     def register_round_grader(self, query: Q, function):
         """Register a round grading function to a set of questions."""
 
-        for round in models.Round.objects.filter(query, competition=self.competition).all():
-            self.round_graders[round.id] = function
+        self.round_registrations.append((query, function))
+        self._plan = None
 
     #####################
     # Grader resolution #
     #####################
 
+    @property
+    def plan(self) -> GraderPlan:
+        """Get the compiled grader plan, compiling it if necessary."""
+
+        if self._plan is None:
+            self._plan = GraderPlan(self)
+        return self._plan
+
     def get_question_grader(self, question: models.Question):
         """Get the registered question grader by the question model."""
 
-        return self.question_graders.get(question.id, self.default_question_grader)
+        return self.plan.question_graders.get(question.id, self.default_question_grader)
 
     def get_round_grader(self, round: models.Round):
         """Get the registered round grader by the round model."""
 
-        return self.round_graders.get(round.id, self.default_round_grader)
+        return self.plan.round_graders.get(round.id, self.default_round_grader)
 
     ##################
     # Actual graders #
     ##################
 
-    def grade_round(self, round: models.Round):
-        """Grade a round."""
+    def grade_round(self, round: models.Round, answers: AnswerMatrix=None):
+        """Grade a round, optionally from already loaded answers."""
 
-        return self.get_round_grader(round)(round)
+        if answers is None:
+            return self.get_round_grader(round)(round)
+        return self.get_round_grader(round)(round, answers)
 
     def grade_competition(self):
         """Grade a competition."""
@@ -246,6 +1370,131 @@ class CompetitionGrader:
             results[round.ref] = self.grade_round(round)
         return results
 
+    #####################
+    # Score combination #
+    #####################
+
+    def z_score(self, raw_scores):
+        """Standardize scores within each division.
+
+        Uses the sample standard deviation, and scores every team or
+        student zero where it is zero or there are fewer than two.
+        Divisions are standardized independently, see `map_divisions`.
+        """
+
+        things = {division: list(raw_scores[division]) for division in raw_scores}
+        standard = map_divisions(standardize, collections.OrderedDict(
+            (division, (numpy.fromiter((raw_scores[division][thing] for thing in members), float, len(members)),))
+            for division, members in things.items()))
+
+        scores = ChillDictionary()
+        for division, members in things.items():
+            scores[division] = ChillDictionary(zip(members, standard[division].tolist()))
+        return scores.dict()
+
+    def combine_scores(self, things, weighted):
+        """Sum weighted scores of teams or students within each division.
+
+        Weighted scores are pairs of a weight and scores grouped by
+        division like grade_round. The scores of each division are
+        aligned into a matrix with a column per source, counting missing
+        entries as zero, and multiplied by the weights at once.
+        """
+
+        divisions = collections.OrderedDict()
+        for thing in things:
+            division = thing.team.division if isinstance(thing, coaches.models.Student) else thing.division
+            divisions.setdefault(division, []).append(thing)
+
+        weights = numpy.array([weight for weight, scores in weighted], dtype=float)
+        work = collections.OrderedDict()
+        for division, members in divisions.items():
+            columns = [scores.get(division, {}) for weight, scores in weighted]
+            matrix = numpy.array([[column.get(thing, 0) for column in columns] for thing in members], dtype=float)
+            work[division] = (matrix, weights)
+
+        combined = ChillDictionary()
+        for division, totals in map_divisions(numpy.dot, work).items():
+            combined[division] = ChillDictionary(zip(divisions[division], totals.tolist()))
+        return combined.dict()
+
+
+def structure_version(competition_id: int):
+    """Get a stamp of the rounds and questions of a competition."""
+
+    return CompetitionGrader.cache.backend.get(STRUCTURE.format(competition_id))
+
+
+def structure_changed(competition_id: int):
+    """Mark the rounds or questions of a competition as changed.
+
+    Graders compile their plans from the rounds and questions of their
+    competition, so the registry rebuilds graders built before this.
+    """
+
+    CompetitionGrader.cache.backend.set(STRUCTURE.format(competition_id), time.time(), None)
+
+
+class GraderRegistry:
+    """Graders of recently used competitions.
+
+    Graders are keyed by competition and grader module, and rebuilt
+    when the rounds or questions of the competition change. At most
+    REGISTRY_SIZE graders are kept, dropping the least recently used
+    first, but the grader of an active competition is never dropped.
+    """
+
+    def __init__(self, size: int=REGISTRY_SIZE):
+        """Initialize an empty registry."""
+
+        self.size = size
+        self.graders = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, competition: models.Competition) -> CompetitionGrader:
+        """Get the grader of a competition, building it if needed."""
+
+        key = (competition.id, competition._grader)
+        stamp = structure_version(competition.id)
+        with self.lock:
+            entry = self.graders.get(key)
+            if entry is not None and entry[0] == stamp:
+                self.graders.move_to_end(key)
+                return entry[1]
+
+        grader = importlib.import_module(competition._grader).Grader(competition)
+        active = models.Competition.current_id()
+        with self.lock:
+            self.graders[key] = (stamp, grader)
+            self.graders.move_to_end(key)
+            self.evict(active)
+        return grader
+
+    def evict(self, active: int=None):
+        """Drop least recently used graders of inactive competitions.
+
+        Graders hold the competition they were built with, so whether it
+        is still active is checked against the id of the competition
+        active now rather than the flag of that instance.
+        """
+
+        excess = len(self.graders) - self.size
+        for key, (stamp, grader) in list(self.graders.items()):
+            if excess <= 0:
+                break
+            if key[0] != active:
+                del self.graders[key]
+                excess -= 1
+
+    def clear(self):
+        """Drop every grader."""
+
+        with self.lock:
+            self.graders.clear()
+
+
+graders = GraderRegistry()
+
 
 def prepare_individual_scores(scores):
     """Prepare the scores from a question score calculation."""
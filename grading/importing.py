@@ -0,0 +1,169 @@
+"""Import graded answer sheets from scanner output.
+
+Answer sheets are read as CSV with a header row or as JSON lines, one
+answer per row, with the following fields:
+
+  team      team number, for team rounds
+  student   student id, for individual rounds
+  round     round ref, such as guts or subject1
+  question  question number
+  value     grade or estimate, blank if ungraded
+
+Rows are parsed and written in batches, so files never have to fit in
+memory. Importing only writes answers whose value differs from the one
+stored, so importing the same file twice changes nothing.
+"""
+
+from django.db import transaction
+
+import csv
+import json
+import itertools
+
+from home.models import Competition
+from coaches.models import Team, Student
+from . import models, grading
+
+
+CSV = "csv"
+JSON = "json"
+
+BATCH_SIZE = 1000
+
+
+class ImportReport:
+    """Summary of an answer import."""
+
+    def __init__(self):
+        """Initialize an empty report."""
+
+        self.rows = 0
+        self.written = 0
+        self.errors = []
+
+    def error(self, line: int, message: str):
+        """Record an error on a line of the input."""
+
+        self.errors.append((line, message))
+
+
+def read_rows(lines, format: str=None):
+    """Parse lines of CSV or JSON into numbered dictionaries lazily.
+
+    If the format is not given, input whose first line starts with a
+    brace is read as JSON lines and anything else as CSV.
+    """
+
+    lines = iter(lines)
+    first = next(lines, "")
+    lines = itertools.chain([first], lines)
+    if format is None:
+        format = JSON if first.lstrip().startswith("{") else CSV
+
+    if format == JSON:
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as error:
+                    yield number, error
+    else:
+        for number, row in enumerate(csv.DictReader(lines), 2):
+            yield number, row
+
+
+def _parse(row, questions: dict, teams: dict):
+    """Resolve a row to a question, group, thing id, and value."""
+
+    if not isinstance(row, dict):
+        raise ValueError("unreadable row: {}".format(row))
+
+    ref = str(row.get("round") or "").strip()
+    try:
+        question = questions[ref, int(row.get("question"))]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("no question {} in round {}".format(row.get("question"), ref or "?"))
+
+    group = grading.GROUPS[question.round.grouping]
+    try:
+        thing = int(row.get(group))
+    except (TypeError, ValueError):
+        raise ValueError("missing {} for round {}".format(group, ref))
+    if group == "team":
+        if thing not in teams:
+            raise ValueError("no team number {}".format(thing))
+        thing = teams[thing]
+
+    value = row.get("value")
+    try:
+        value = None if value is None or str(value).strip() == "" else float(value)
+    except ValueError:
+        raise ValueError("{} is not a number".format(value))
+
+    return question, group, thing, value
+
+
+def _write(competition: Competition, batch, report: ImportReport):
+    """Write a batch of parsed rows in a single transaction."""
+
+    # Students are checked against the competition a batch at a time
+    student_ids = {thing for _, (_, group, thing, _) in batch if group == "student"}
+    students = set(Student.objects.filter(
+        id__in=student_ids, team__competition=competition).values_list("id", flat=True))
+
+    cells = {}
+    for line, (question, group, thing, value) in batch:
+        if group == "student" and thing not in students:
+            report.error(line, "no student with id {}".format(thing))
+            continue
+        cells[question, group, thing] = value
+
+    # Load the existing answers to every cell in the batch
+    existing = {}
+    for group in ("student", "team"):
+        things = {thing for _, g, thing in cells if g == group}
+        if not things:
+            continue
+        query = models.Answer.objects.filter(
+            question_id__in={question.id for question, g, _ in cells if g == group},
+            **{group + "_id__in": things})
+        for answer in query:
+            existing[answer.question_id, group, getattr(answer, group + "_id")] = answer
+
+    rounds = {}
+    for (question, group, thing), value in cells.items():
+        answer = existing.get((question.id, group, thing))
+        if answer is None:
+            answer = models.Answer(question=question, **{group + "_id": thing})
+        answer.question = question
+        rounds.setdefault(question.round, []).append((answer, value))
+
+    with transaction.atomic():
+        for round, values in rounds.items():
+            report.written += grading.save_answers(round, values)
+
+
+def import_answers(competition: Competition, lines, format: str=None, batch_size: int=BATCH_SIZE):
+    """Import answers from lines of CSV or JSON into a competition."""
+
+    questions = {}
+    for question in models.Question.objects.filter(round__competition=competition).select_related(
+            "round__competition"):
+        questions[question.round.ref, question.number] = question
+    teams = dict(Team.objects.filter(competition=competition).values_list("number", "id"))
+
+    report = ImportReport()
+    batch = []
+    for line, row in read_rows(lines, format):
+        report.rows += 1
+        try:
+            batch.append((line, _parse(row, questions, teams)))
+        except ValueError as error:
+            report.error(line, str(error))
+        if len(batch) >= batch_size:
+            _write(competition, batch, report)
+            batch = []
+    if batch:
+        _write(competition, batch, report)
+
+    return report
@@ -0,0 +1,160 @@
+"""Run scoreboard recalculations in the background.
+
+Recalculating a scoreboard regrades the whole competition, which is too
+slow to do while a request waits on it. Jobs are instead submitted to a
+small thread pool within the process, keyed by what they recalculate,
+and the scoreboard pages poll their status. Submitting a job while one
+with the same key is still running returns the running job, so repeated
+clicks on recalculate coalesce into a single regrade.
+
+Jobs claim their key and publish their status in the shared grader
+cache, so a job running in one worker process is also seen, and not
+started again, by the others. Claims expire after JOB_TIMEOUT seconds
+in case the process running the job dies.
+"""
+
+from django.conf import settings
+from django.db import connection
+
+from concurrent.futures import ThreadPoolExecutor
+
+import time
+import logging
+import threading
+import traceback
+
+from . import grading
+
+
+logger = logging.getLogger(__name__)
+
+# Recalculations that may run at once, or zero to run them in the caller
+WORKERS = getattr(settings, "GRADING_WORKERS", 1)
+
+# Seconds a job holds its key, and where job claims and statuses are shared
+JOB_TIMEOUT = getattr(settings, "GRADING_JOB_TIMEOUT", 600)
+JOBS = grading.GraderCache("jobs")
+STATUS = ("submitted", "started", "finished", "error")
+
+
+def job_name(key) -> str:
+    """Get the name a job is claimed and published under."""
+
+    return ":".join(map(str, key)) if isinstance(key, tuple) else str(key)
+
+
+class Job:
+    """A recalculation submitted to the background executor."""
+
+    def __init__(self, key):
+        """Initialize a job that has not started yet."""
+
+        self.key = key
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.done = threading.Event()
+
+    @classmethod
+    def load(cls, key, status: dict) -> "Job":
+        """Get a job from the status another process published."""
+
+        job = cls(key)
+        job.__dict__.update(status)
+        if job.running and job_name(key) + grading.COMPUTING not in JOBS:
+            job.finished = time.time()
+            job.error = "The recalculation was abandoned."
+        return job
+
+    def publish(self):
+        """Share the status of the job with other processes."""
+
+        JOBS[job_name(self.key)] = {name: getattr(self, name) for name in STATUS}
+
+    @property
+    def running(self) -> bool:
+        """Check whether the job is queued or running."""
+
+        return self.finished is None
+
+    @property
+    def elapsed(self) -> int:
+        """Get the whole seconds since the job started, or was submitted."""
+
+        return int((self.finished or time.time()) - (self.started or self.submitted))
+
+    def run(self, function, *args):
+        """Run the job, recording when it finished and how it failed."""
+
+        self.started = time.time()
+        self.publish()
+        try:
+            function(*args)
+        except Exception:
+            self.error = traceback.format_exc()
+            logger.exception("Recalculation {} failed".format(self.key))
+        finally:
+            self.finished = time.time()
+            self.publish()
+            grading.release(JOBS, job_name(self.key))
+            self.done.set()
+
+    def wait(self, timeout: float=None) -> bool:
+        """Wait for the job to finish, returning whether it has."""
+
+        return self.done.wait(timeout)
+
+
+class Executor:
+    """Background executor that coalesces jobs by key."""
+
+    def __init__(self, workers: int=WORKERS):
+        """Initialize the executor, starting threads as jobs arrive."""
+
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, function, *args) -> Job:
+        """Run a function in the background unless a job with its key is running.
+
+        The running job is returned instead, whichever process runs it.
+        """
+
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is not None and job.running:
+                return job
+            if not grading.claim(JOBS, job_name(key), JOB_TIMEOUT):
+                return self.status(key) or Job(key)
+            job = self.jobs[key] = Job(key)
+            job.publish()
+
+        if self.pool is None:
+            job.run(function, *args)
+        else:
+            self.pool.submit(self.run, job, function, *args)
+        return job
+
+    @staticmethod
+    def run(job: Job, function, *args):
+        """Run a job on a pool thread, closing its database connection after."""
+
+        try:
+            job.run(function, *args)
+        finally:
+            connection.close()
+
+    def status(self, key) -> Job:
+        """Get the latest job submitted with a key by any process, if any."""
+
+        job = self.jobs.get(key)
+        if job is not None and job.running:
+            return job
+        status = JOBS.get(job_name(key))
+        return Job.load(key, status) if status is not None else job
+
+
+executor = Executor()
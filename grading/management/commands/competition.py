@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand, CommandError
-from grading import models
+from grading import models, importing, exporting, grading
 
 import os
 import json
@@ -48,7 +48,7 @@ def load(path, loader=json.load):
 
 
 class Command(BaseCommand):
-    """Import a competition file into the database."""
+    """Load, import answers into, and grade competitions."""
 
     def add_arguments(self, parser):
         """Add arguments to the command line parser."""
@@ -56,6 +56,16 @@ class Command(BaseCommand):
         subparsers = parser.add_subparsers(dest="command", metavar="command")
         load_parser = subparsers.add_parser("load", help="load a competition file", cmd=self)
         load_parser.add_argument("file", help="competition JSON summary")
+        import_parser = subparsers.add_parser("import", help="import graded answers", cmd=self)
+        import_parser.add_argument("file", help="answers as CSV or JSON lines")
+        import_parser.add_argument("--format", choices=(importing.CSV, importing.JSON), help="input format")
+        import_parser.add_argument("--batch", type=int, default=importing.BATCH_SIZE, help="rows per transaction")
+        grade_parser = subparsers.add_parser("grade", help="grade and write scoreboards to files", cmd=self)
+        grade_parser.add_argument("--competition", type=int, action="append", help="competition id, current if none")
+        grade_parser.add_argument("--all", action="store_true", help="grade every competition with a grader")
+        grade_parser.add_argument("--output", default="scoreboards", help="directory to write scoreboards to")
+        grade_parser.add_argument("--format", choices=(exporting.JSON, exporting.CSV), default=exporting.JSON)
+        grade_parser.add_argument("--processes", type=int, help="worker processes for per-division work")
 
     def handle(self, *args, **kwargs):
         """Handle a call to the command."""
@@ -68,5 +78,41 @@ class Command(BaseCommand):
             load(path)
             print("Done in {} seconds!".format(round(time.time() - start, 3)))
 
+        elif kwargs["command"] == "import":
+            start = time.time()
+            path = kwargs["file"]
+            if not os.path.isfile(path):
+                raise CommandError("Path is invalid!")
+            with open(path, "r", newline="") as file:
+                report = importing.import_answers(
+                    models.Competition.current(), file, kwargs["format"], kwargs["batch"])
+            for line, message in report.errors:
+                print("Line {}: {}".format(line, message))
+            print("Read {} rows, wrote {} answers, {} errors.".format(
+                report.rows, report.written, len(report.errors)))
+            print("Done in {} seconds!".format(round(time.time() - start, 3)))
+
+        elif kwargs["command"] == "grade":
+            if kwargs["all"]:
+                competitions = models.Competition.objects.exclude(_grader=None).exclude(_grader="").order_by("id")
+            elif kwargs["competition"]:
+                competitions = models.Competition.objects.filter(id__in=kwargs["competition"]).order_by("id")
+            else:
+                competitions = [models.Competition.current()]
+            competitions = [competition for competition in competitions if competition is not None]
+            if not competitions:
+                raise CommandError("No competitions to grade!")
+            if kwargs["processes"] is not None:
+                grading.PROCESSES = kwargs["processes"]
+
+            for competition in competitions:
+                if not competition._grader:
+                    raise CommandError("{} has no grader!".format(competition.name))
+                print("Grading {}...".format(competition.name))
+                report = exporting.grade(competition, kwargs["output"], kwargs["format"])
+                for stage, seconds in report.timings:
+                    print("  {}: {} seconds".format(stage, round(seconds, 3)))
+                print("  Wrote {} files to {}".format(len(report.files), report.directory))
+
         else:
             print("The current competition is {}.".format(models.Competition.current().name))
@@ -31,6 +31,9 @@ class Round(models.Model):
     competition = models.ForeignKey(Competition, related_name="rounds")
     grouping = models.IntegerField(choices=_ROUND_GROUPINGS)
 
+    # Sum of answer hashes, adjusted as answers change
+    checksum = models.BigIntegerField(default=0)
+
     # TODO: consider having general polymorphic rounds
     # Have single or multiple tests that can be taken by choice
     # Somehow link to student and form for actual test PDF
@@ -61,8 +64,8 @@ class Question(models.Model):
     answer = models.FloatField(blank=True, null=True)
 
     # TODO: Make sure this is the optimal information for a question
-    # Consider having a statistics utility for the question model that
-    # returns correct, incorrect, and skipped counts.
+    # Correct, incorrect, and skipped counts are kept in the question
+    # statistics table, see grading.statistics.
 
     def __repr__(self):
         """Represent the question as a string."""
@@ -97,3 +100,63 @@ class Answer(models.Model):
     # TODO: answers have to be queried for statistics, so either the
     # statistics wrapper make such queries or the queries will be
     # defined under the answer model.
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the stored value so changes to it can be graded."""
+
+        answer = super().from_db(db, field_names, values)
+        answer._loaded_value = answer.value
+        return answer
+
+
+class RoundTotal(models.Model):
+    """A running total of the grades of a team or student in a round.
+
+    Totals are adjusted as answers change so that live scoreboards can
+    be read without regrading the whole round.
+    """
+
+    round = models.ForeignKey(Round, related_name="totals")
+    student = models.ForeignKey(Student, related_name="totals", null=True, blank=True)
+    team = models.ForeignKey(Team, related_name="totals", null=True, blank=True)
+    value = models.FloatField(default=0)
+
+
+class QuestionStatistics(models.Model):
+    """Answer counts for a question within a division and subject.
+
+    Rows are refreshed whenever answers to the question are written so
+    that statistics and grading bonuses can be read per question rather
+    than by scanning answers. The subject is blank for team rounds, and
+    the attending counts only include answers from attending students.
+    """
+
+    question = models.ForeignKey(Question, related_name="statistics")
+    division = models.IntegerField()
+    subject = models.CharField(max_length=2, blank=True)
+    correct = models.IntegerField(default=0)
+    incorrect = models.IntegerField(default=0)
+    blank = models.IntegerField(default=0)
+    attending = models.IntegerField(default=0)
+    attending_value = models.FloatField(default=0)
+
+
+class ScoreboardSnapshot(models.Model):
+    """Scoreboard results of a competition at a version of its answers.
+
+    Results are the cached outputs of the grader, with students and
+    teams replaced by references, pickled and compressed into data.
+    Names lists which outputs the snapshot holds.
+    """
+
+    competition = models.ForeignKey(Competition, related_name="snapshots")
+    version = models.IntegerField()
+    updated = models.DateTimeField(auto_now=True)
+    names = models.CharField(max_length=512, blank=True)
+    data = models.BinaryField()
+
+    class Meta:
+        """Meta information about the snapshot."""
+
+        unique_together = ("competition", "version")
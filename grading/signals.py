@@ -0,0 +1,132 @@
+"""Signal receivers that keep cached grades consistent with answers.
+
+Saving or deleting an answer or question invalidates whatever was
+graded from its round, changing a round or question rebuilds the
+grader of its competition, changing the attendance, subjects, or team
+of a student invalidates everything that depends on attendance, and
+changing the division of a team, or adding or removing one, also
+invalidates the team rounds of its competition. Edits to other fields,
+such as names and shirt sizes, leave grades alone. Answer changes also
+adjust the running totals of the round, and answer, student, and team
+changes recount the statistics of the questions involved. Bulk writes do not send
+these signals, so code that performs them must call
+`grading.answers_changed` itself, as `grading.save_answers` does.
+Invalidation waits until the transaction of the change commits.
+"""
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.db.models import Q
+
+import copy
+
+from coaches.models import Team, Student
+from . import models, grading, statistics
+
+
+@receiver(post_save, sender=models.Answer)
+def answer_saved(sender, instance: models.Answer, created: bool=False, **kwargs):
+    """Update running totals and invalidate grades from the round of the answer."""
+
+    answer_changed(instance, getattr(instance, "_loaded_value", None), created)
+    instance._loaded_value = instance.value
+
+
+@receiver(post_delete, sender=models.Answer)
+def answer_deleted(sender, instance: models.Answer, **kwargs):
+    """Update running totals and invalidate grades from the round of the answer."""
+
+    deleted = copy.copy(instance)
+    deleted.value = None
+    answer_changed(deleted, instance.value, True)
+
+
+def answer_changed(answer: models.Answer, previous, counted: bool=False):
+    """Handle an answer changing from its previous value.
+
+    Creating or deleting an answer changes the question statistics even
+    if its value stays blank, which counted forces.
+    """
+
+    round = models.Round.objects.select_related("competition").filter(questions=answer.question_id).first()
+    if round is not None:
+        grading.answers_changed(round, [(answer, previous)] if counted or answer.value != previous else [])
+
+
+@receiver(post_save, sender=models.Question)
+@receiver(post_delete, sender=models.Question)
+def question_changed(sender, instance: models.Question, **kwargs):
+    """Invalidate grades from the round of the question and its grader plan."""
+
+    round = models.Round.objects.filter(id=instance.round_id).values_list("ref", "competition_id").first()
+    if round is not None:
+        grading.after_commit(grading.invalidate, (grading.ROUND, round[0]))
+        grading.after_commit(grading.structure_changed, round[1])
+        grading.after_commit(grading.answer_set_changed, id=round[1])
+
+
+@receiver(post_save, sender=models.Round)
+@receiver(post_delete, sender=models.Round)
+def round_changed(sender, instance: models.Round, **kwargs):
+    """Rebuild the grader of the competition of the round."""
+
+    grading.after_commit(grading.structure_changed, instance.competition_id)
+
+
+def graded_fields_changed(instance, created: bool) -> bool:
+    """Check whether a saved student or team changed fields grades depend on."""
+
+    loaded = getattr(instance, "_loaded_graded", None)
+    instance._loaded_graded = instance.graded_fields()
+    return created or loaded != instance._loaded_graded
+
+
+@receiver(post_save, sender=Student)
+def student_saved(sender, instance: Student, created: bool=False, **kwargs):
+    """Invalidate grades if the attendance, subjects, or team of a student changed."""
+
+    if graded_fields_changed(instance, created):
+        student_changed(instance)
+
+
+@receiver(post_delete, sender=Student)
+def student_deleted(sender, instance: Student, **kwargs):
+    """Invalidate grades that depend on attendance."""
+
+    student_changed(instance)
+
+
+def student_changed(student: Student):
+    """Invalidate grades that depend on attendance and recount statistics."""
+
+    grading.after_commit(grading.invalidate, grading.ATTENDANCE)
+    grading.after_commit(grading.answer_set_changed, teams=student.team_id)
+    statistics.refresh_question_statistics(
+        models.Answer.objects.filter(student_id=student.id).values_list("question_id", flat=True))
+
+
+@receiver(post_save, sender=Team)
+def team_saved(sender, instance: Team, created: bool=False, **kwargs):
+    """Invalidate grades and recount statistics if the division of a team changed."""
+
+    if graded_fields_changed(instance, created):
+        team_changed(instance)
+        statistics.refresh_question_statistics(
+            models.Answer.objects.filter(Q(team_id=instance.id) | Q(student__team_id=instance.id))
+            .values_list("question_id", flat=True))
+
+
+@receiver(post_delete, sender=Team)
+def team_deleted(sender, instance: Team, **kwargs):
+    """Invalidate grades from the team rounds of the competition of the team."""
+
+    team_changed(instance)
+
+
+def team_changed(team: Team):
+    """Invalidate the team rounds of a competition and whatever depends on attendance."""
+
+    refs = models.Round.objects.filter(
+        competition_id=team.competition_id, grouping=models.TEAM).values_list("ref", flat=True)
+    grading.after_commit(grading.invalidate, grading.ATTENDANCE, *((grading.ROUND, ref) for ref in refs))
+    grading.after_commit(grading.answer_set_changed, id=team.competition_id)
@@ -0,0 +1,138 @@
+"""Persist scoreboard results between worker restarts.
+
+The outputs of the final scoreboard calculations are written to the
+scoreboard snapshot table, keyed by competition and the answer version
+of the competition when grading started. Answers, questions, and
+attendance bump the version, so a snapshot at the current version is
+exactly what a regrade would produce. Restoring one into a cold grader
+cache is a single read instead of a full regrade, and since snapshots
+are kept, two versions of a scoreboard can be compared afterwards.
+"""
+
+import zlib
+import pickle
+
+from . import models, grading
+
+
+# Cached grader outputs stored in snapshots and what they depend on
+SNAPSHOT = (
+    ("individual_scores", ()),
+    ("subject_scores", ("individual_scores",)),
+    ("raw_individual_scores", ("individual_scores",)),
+    ("individual_powers", ("individual_scores",)),
+    ("individual_bonus", ("individual_scores",)),
+    ("team_individual_scores", ()),
+    ("team_scores", ()),
+    ("raw_team_scores", ("team_scores",)),
+    ("guts_scores", ()),
+    ("raw_guts_scores", ("guts_scores",)),
+    ("team_overall_scores", ()))
+
+
+def answer_version(competition: models.Competition) -> int:
+    """Read the current answer version of a competition."""
+
+    return models.Competition.objects.filter(id=competition.id).values_list("answer_version", flat=True).first()
+
+
+def encode(results: dict) -> bytes:
+    """Compress cached outputs with students and teams as references."""
+
+    return zlib.compress(pickle.dumps(grading.dehydrate(results), pickle.HIGHEST_PROTOCOL))
+
+
+def decode(data) -> dict:
+    """Decompress cached outputs, leaving references to students and teams."""
+
+    return pickle.loads(zlib.decompress(bytes(data)))
+
+
+def cached_names(grader: grading.CompetitionGrader) -> set:
+    """Get the snapshot outputs the grader cache holds fresh, without loading them."""
+
+    return grading.fresh_names(grading.scope_cache(grader.cache, (grader,)), [name for name, _ in SNAPSHOT])
+
+
+def restore(grader: grading.CompetitionGrader) -> int:
+    """Fill a cold grader cache from the snapshot of the current version.
+
+    Outputs already in the cache are left alone. The answer version is
+    returned so that results computed afterwards can be recorded under
+    the version they were graded from.
+    """
+
+    version = answer_version(grader.competition)
+    cached = cached_names(grader)
+    if len(cached) == len(SNAPSHOT):
+        return version
+
+    snapshot = models.ScoreboardSnapshot.objects.filter(
+        competition=grader.competition, version=version).only("data").first()
+    if snapshot is not None:
+        results = grading.hydrate(decode(snapshot.data))
+        for name, depends_on in SNAPSHOT:
+            if name in results and name not in cached:
+                grader.cache_set(name, results[name], depends_on)
+    return version
+
+
+def record(grader: grading.CompetitionGrader, version: int):
+    """Write the cached outputs of a grader as the snapshot of a version.
+
+    Nothing is written if answers changed since the version was read,
+    or if the stored snapshot already holds every cached output.
+    """
+
+    cached = cached_names(grader)
+    if not cached or answer_version(grader.competition) != version:
+        return
+
+    stored = models.ScoreboardSnapshot.objects.filter(
+        competition=grader.competition, version=version).values_list("names", flat=True).first()
+    if stored is not None and set(stored.split(",")) >= cached:
+        return
+
+    results = {}
+    for name, _ in SNAPSHOT:
+        result = grader.cache_get(name) if name in cached else None
+        if result is not None:
+            results[name] = result
+    if not results:
+        return
+
+    names = ",".join(sorted(results))
+    models.ScoreboardSnapshot.objects.update_or_create(
+        competition=grader.competition, version=version, defaults={"names": names, "data": encode(results)})
+
+
+def _flatten(value, path, flat: dict):
+    """Flatten nested dictionaries into a dictionary keyed by path."""
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(item, path + (key,), flat)
+    else:
+        flat[path] = value
+    return flat
+
+
+def diff(old: models.ScoreboardSnapshot, new: models.ScoreboardSnapshot) -> dict:
+    """Compare two snapshots by output.
+
+    Differences are keyed by output name and then by the path of keys
+    to each differing score, such as division and student reference,
+    and are pairs of the old and new score, with None where missing.
+    Outputs missing from either snapshot are skipped.
+    """
+
+    old_results, new_results = decode(old.data), decode(new.data)
+    changes = {}
+    for name in old_results.keys() & new_results.keys():
+        before = _flatten(old_results[name], (), {})
+        after = _flatten(new_results[name], (), {})
+        changed = {path: (before.get(path), after.get(path))
+                   for path in before.keys() | after.keys() if before.get(path) != after.get(path)}
+        if changed:
+            changes[name] = changed
+    return changes
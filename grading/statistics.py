@@ -0,0 +1,177 @@
+"""Aggregate answer statistics by question.
+
+Correct, incorrect, and blank counts for each question are materialized
+by division and subject in the question statistics table, which is
+refreshed for the questions whose answers are written. Reading the
+statistics of a round is then a single query over its questions rather
+than over its answers. Guesses to estimation questions are not stored
+and are instead counted by value with one grouped query.
+"""
+
+from django.db import transaction
+from django.db.models import Count
+
+import collections
+
+from . import models
+
+
+CORRECT = 0
+INCORRECT = 1
+BLANK = 2
+
+# Fields students are split into subjects by for each individual round
+SUBJECT_FIELDS = {"subject1": "student__subject1", "subject2": "student__subject2"}
+
+
+class RoundStatistics:
+    """Answer counts for each question of a round.
+
+    Counts are keyed by division and subject, where the subject is None
+    for team rounds, and then by question number. Each count is a list
+    of correct, incorrect, and blank answers. Guesses to estimation
+    questions are kept instead as counters of each value given.
+    """
+
+    def __init__(self, round: models.Round):
+        """Initialize empty statistics for a round."""
+
+        self.round = round
+        self.counts = collections.defaultdict(dict)
+        self.guesses = collections.defaultdict(dict)
+
+    def questions(self, division: int, subject: str=None):
+        """Get the sorted question counts for a division and subject."""
+
+        return sorted(self.counts.get((division, subject), {}).items())
+
+    def estimations(self, division: int, subject: str=None):
+        """Get the sorted guess distributions for a division and subject."""
+
+        return sorted(self.guesses.get((division, subject), {}).items())
+
+
+def refresh_question_statistics(question_ids):
+    """Recount the answers to questions and replace their statistics."""
+
+    question_ids = set(question_ids)
+    if not question_ids:
+        return
+
+    rows = {}
+
+    def count(question_id, division, subject, attending, value, n):
+        row = rows.get((question_id, division, subject))
+        if row is None:
+            row = rows[question_id, division, subject] = models.QuestionStatistics(
+                question_id=question_id, division=division, subject=subject or "")
+        if value is None:
+            row.blank += n
+        elif value == 1:
+            row.correct += n
+        elif value == 0:
+            row.incorrect += n
+        if attending:
+            row.attending += n
+            row.attending_value += (value or 0) * n
+
+    individual = (models.Answer.objects
+                  .filter(question_id__in=question_ids, student__isnull=False)
+                  .values_list("question_id", "question__round__ref", "student__team__division",
+                               "student__subject1", "student__subject2", "student__attending", "value")
+                  .annotate(n=Count("id"))
+                  .order_by())
+    for question_id, ref, division, subject1, subject2, attending, value, n in individual:
+        subject = subject2 if ref == "subject2" else subject1
+        count(question_id, division, subject, attending, value, n)
+
+    team = (models.Answer.objects
+            .filter(question_id__in=question_ids, team__isnull=False)
+            .values_list("question_id", "team__division", "value")
+            .annotate(n=Count("id"))
+            .order_by())
+    for question_id, division, value, n in team:
+        count(question_id, division, None, True, value, n)
+
+    with transaction.atomic():
+        models.QuestionStatistics.objects.filter(question_id__in=question_ids).delete()
+        models.QuestionStatistics.objects.bulk_create(rows.values())
+
+
+def rebuild_question_statistics(round: models.Round):
+    """Recount the statistics of every question in a round."""
+
+    refresh_question_statistics(round.questions.values_list("id", flat=True))
+
+
+def question_statistics(round: models.Round):
+    """Get the statistics rows of a round, counting them if missing.
+
+    Answers written in bulk before the table existed have no statistics,
+    so the round is recounted once if it has answers but no rows.
+    """
+
+    rows = models.QuestionStatistics.objects.filter(question__round=round).select_related("question")
+    if not rows and models.Answer.objects.filter(question__round=round).exists():
+        rebuild_question_statistics(round)
+        rows = rows.all()
+    return rows
+
+
+def attending_counts(*rounds: models.Round):
+    """Total the answers of attending students to questions of rounds.
+
+    Returns the sum of values and number of answers from attending
+    students keyed by division, subject, and question number, summing
+    the same question number across rounds. The totals are read in a
+    single query, recounting any round that has answers but no rows.
+    """
+
+    query = (models.QuestionStatistics.objects
+             .filter(question__round__in=rounds)
+             .values_list("question__round_id", "division", "subject", "question__number",
+                          "attending_value", "attending"))
+    rows = list(query)
+    counted = {row[0] for row in rows}
+    missing = [round for round in rounds if round.id not in counted]
+    if missing and models.Answer.objects.filter(question__round__in=missing).exists():
+        for round in missing:
+            rebuild_question_statistics(round)
+        rows = list(query.all())
+
+    counts = {}
+    for round_id, division, subject, number, value, attending in rows:
+        if attending:
+            total = counts.setdefault((division, subject, number), [0, 0])
+            total[0] += value
+            total[1] += attending
+    return counts
+
+
+def round_statistics(round: models.Round) -> RoundStatistics:
+    """Read the answer counts to each question of a round."""
+
+    statistics = RoundStatistics(round)
+    estimation = False
+    for row in question_statistics(round):
+        if row.question.type == models.ESTIMATION:
+            estimation = True
+            continue
+        key = (row.division, row.subject if round.grouping == models.INDIVIDUAL else None)
+        statistics.counts[key][row.question.number] = [row.correct, row.incorrect, row.blank]
+
+    if estimation:
+        division = "student__team__division" if round.grouping == models.INDIVIDUAL else "team__division"
+        subject = SUBJECT_FIELDS.get(round.ref) if round.grouping == models.INDIVIDUAL else None
+        fields = (division, subject) if subject else (division,)
+        query = (models.Answer.objects
+                 .filter(question__round=round, question__type=models.ESTIMATION)
+                 .values_list(*fields, "question__number", "value")
+                 .annotate(count=Count("id"))
+                 .order_by())
+        for row in query:
+            key = (row[0], row[1] if subject else None)
+            number, value, count = row[-3:]
+            statistics.guesses[key].setdefault(number, collections.Counter())[value] += count
+
+    return statistics
@@ -1,4 +1,5 @@
 from django import template
+from django.db.models import Count
 
 from grading.models import Team, Student, Round, Answer
 
@@ -11,10 +12,44 @@ ICON_NO = u"""<img src="/static/admin/img/icon-no.svg">"""
 ICON_ALERT = u"""<img src="/static/admin/img/icon-alert.svg">"""
 
 
+def annotate_grading_status(teams_or_students, rounds):
+    """Count graded and total answers by round in a single query.
+
+    Each team or student is given a graded attribute mapping round refs
+    to a pair of the number of graded answers and the number of answers,
+    which the grading status filter reads instead of querying.
+    """
+
+    teams_or_students = list(teams_or_students)
+    if not teams_or_students:
+        return teams_or_students
+    group = "team" if isinstance(teams_or_students[0], Team) else "student"
+
+    for thing in teams_or_students:
+        thing.graded = {ref: (0, 0) for ref in rounds}
+    things = {thing.id: thing for thing in teams_or_students}
+    counts = (Answer.objects
+              .filter(**{group + "_id__in": things}, question__round__ref__in=rounds)
+              .values_list(group + "_id", "question__round__ref")
+              .annotate(graded=Count("value"), total=Count("id"))
+              .order_by())
+    for thing_id, ref, graded, total in counts:
+        things[thing_id].graded[ref] = (graded, total)
+
+    return teams_or_students
+
+
 @register.filter(is_safe=True)
 def grading_status(team_or_student, round):
     """Check the grading status for a team or student by round."""
 
+    graded = getattr(team_or_student, "graded", {})
+    if isinstance(round, str) and round in graded:
+        graded, total = graded[round]
+        if graded:
+            return ICON_YES + (ICON_ALERT if total > graded else "")
+        return ICON_NO
+
     if isinstance(round, str):
         round = Round.objects.filter(ref=round).first()
 
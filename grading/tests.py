@@ -1,3 +1,1041 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.shortcuts import reverse
+from django.db import transaction
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.contrib.auth.models import User
 
-# Create your tests here.
+import os
+import csv
+import json
+import tempfile
+import threading
+from statistics import mean, stdev
+from unittest import mock
+
+from home.models import Competition
+from coaches.models import School, Team, Student
+from . import models, grading, importing, exporting, jobs, snapshots, statistics, views
+from .templatetags.grading_status import annotate_grading_status, grading_status
+
+
+# Tests keep grades, change stamps, and job claims out of the real cache
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-default"},
+    "grading": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-grading"}}
+
+
+def clear_caches():
+    """Clear every cache used by the tests."""
+
+    for alias in CACHES:
+        caches[alias].clear()
+
+
+@override_settings(CACHES=CACHES)
+class GradingTestCase(TestCase):
+    """Base test case with a small competition to grade."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Run commit hooks at once, since test transactions never commit."""
+
+        cls.on_commit = mock.patch.object(transaction, "on_commit", lambda function: function())
+        cls.on_commit.start()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Restore commit hooks."""
+
+        super().tearDownClass()
+        cls.on_commit.stop()
+
+    def setUp(self):
+        """Start every test with empty caches."""
+
+        clear_caches()
+
+    def login_staff(self):
+        """Log the test client in as a staff member."""
+
+        self.client.force_login(User.objects.create_user("grader", password="grader", is_staff=True))
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create a competition with a team and an individual round."""
+
+        today = timezone.now().date()
+        cls.competition = Competition.objects.create(
+            name="MBMT Test",
+            date=today,
+            active=True,
+            date_registration_start=today,
+            date_registration_end=today,
+            date_edit_teams_end=today,
+            date_edit_shirts_end=today,
+            year="test")
+
+        cls.individual = models.Round.new(cls.competition, "subject1", name="Individual", grouping=models.INDIVIDUAL)
+        cls.team = models.Round.new(cls.competition, "team", name="Team", grouping=models.TEAM)
+        for round in (cls.individual, cls.team):
+            for number in range(1, 5):
+                models.Question.new(round, number, label=str(number), type=models.CORRECT, weight=number)
+
+        school = School.objects.create(name="Test School")
+        cls.teams = []
+        cls.students = []
+        for i in range(4):
+            team = Team.objects.create(name="Team {}".format(i), number=i, school=school,
+                                       competition=cls.competition, division=1 + i % 2)
+            cls.teams.append(team)
+            for j in range(2):
+                cls.students.append(Student.objects.create(
+                    first_name="Student", last_name="{}{}".format(i, j), team=team,
+                    subject1="al", subject2="nt", grade=7, shirt_size=1, attending=True))
+
+        # Team i answers its first i questions correctly, students likewise
+        for i, team in enumerate(cls.teams):
+            for question in cls.team.questions.all():
+                models.Answer.objects.create(question=question, team=team, value=int(question.number <= i))
+        for i, student in enumerate(cls.students):
+            for question in cls.individual.questions.all():
+                models.Answer.objects.create(
+                    question=question, student=student, value=None if i % 3 == 0 else int(question.number <= i))
+
+
+class AnswerMatrixTests(GradingTestCase):
+    """Test the bulk answer loader and the default round grader."""
+
+    def test_single_query(self):
+        with self.assertNumQueries(2):
+            answers = grading.AnswerMatrix(self.team)
+        self.assertEqual(len(answers.answers), len(self.teams))
+        self.assertEqual(answers.get(self.teams[2].id, 2).value, 1)
+        self.assertIsNone(answers.get(self.teams[2].id, 5))
+
+    def test_default_round_grader(self):
+        grader = grading.CompetitionGrader(self.competition)
+        grader.plan
+        with self.assertNumQueries(2):
+            scores = grader.grade_round(self.team)
+        for i, team in enumerate(self.teams):
+            self.assertEqual(scores[team.division][team], sum(range(1, i + 1)))
+
+    def test_query_count_independent_of_field(self):
+        grader = grading.CompetitionGrader(self.competition)
+        grader.plan
+        with self.assertNumQueries(2):
+            scores = grader.grade_round(self.individual)
+        self.assertEqual(sum(len(scores[division]) for division in scores), len(self.students))
+
+
+class VectorizedGradingTests(GradingTestCase):
+    """Test that vectorized column grading matches per-answer grading."""
+
+    def test_matches_per_answer_grading(self):
+        grader = grading.CompetitionGrader(self.competition)
+        answers = grader.load_answers(self.individual)
+        vectorized = grader.grade_answers(answers)
+        grader.VECTORIZE = False
+        self.assertEqual(vectorized.tolist(), grader.grade_answers(answers).tolist())
+
+    def test_fallback_when_not_vectorizable(self):
+        grader = grading.CompetitionGrader(self.competition)
+
+        def column_grader(grader, question, values, answers):
+            return None
+
+        @grading.vectorized(column_grader)
+        def question_grader(question, answer):
+            return 2 * (answer.value or 0)
+
+        grader.register_question_grader(grading.Q(round=self.team), question_grader)
+        scores = grader.grade_round(self.team)
+        for i, team in enumerate(self.teams):
+            self.assertEqual(scores[team.division][team], 2 * i)
+
+
+class PowerAverageTests(TestCase):
+    """Test solving for power average exponents together."""
+
+    def test_matches_scalar_solver(self):
+        score_sets = [[1, 0.5, 0.25, 0], [1, 0.9, 0.1, 0.1, 0, 0], [0.2, 1, 0.4, 0.6, 0.8]]
+        exponents = grading.solve_power_averages(score_sets, 0.375)
+        for scores, exponent in zip(score_sets, exponents):
+            self.assertAlmostEqual(exponent, grading._solve_power_average(scores, 0.375, 0.0001, 1000), places=8)
+
+
+class CacheInvalidationTests(GradingTestCase):
+    """Test that answer changes invalidate dependent cached grades."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache = {}
+        self.calls = []
+
+        @grading.cached(self.cache, "team_scores", depends_on=[(grading.ROUND, "team")])
+        def team_scores():
+            self.calls.append("team_scores")
+            return 1
+
+        @grading.cached(self.cache, "individual_scores", depends_on=[(grading.ROUND, "subject1"), grading.ATTENDANCE])
+        def individual_scores():
+            self.calls.append("individual_scores")
+            return 2
+
+        @grading.cached(self.cache, "overall_scores", depends_on=["team_scores"])
+        def overall_scores():
+            self.calls.append("overall_scores")
+            return team_scores() + 1
+
+        self.team_scores = team_scores
+        self.individual_scores = individual_scores
+        self.overall_scores = overall_scores
+        overall_scores()
+        individual_scores()
+
+    def test_answer_change(self):
+        answer = models.Answer.objects.filter(team=self.teams[0]).first()
+        answer.value = 1 - answer.value
+        answer.save()
+        self.assertIsNone(grading.cache_get(self.cache, "team_scores"))
+        self.assertIsNone(grading.cache_get(self.cache, "overall_scores"))
+        self.assertEqual(grading.cache_get(self.cache, "individual_scores"), 2)
+        self.overall_scores()
+        self.assertEqual(self.calls.count("team_scores"), 2)
+
+    def test_attendance_change(self):
+        student = Student.objects.get(id=self.students[0].id)
+        student.attending = False
+        student.save()
+        self.assertIsNone(grading.cache_get(self.cache, "individual_scores"))
+        self.assertEqual(grading.cache_get(self.cache, "overall_scores"), 2)
+
+    def test_ungraded_change(self):
+        student = Student.objects.get(id=self.students[0].id)
+        student.shirt_size = 2
+        student.save()
+        team = Team.objects.get(id=self.teams[0].id)
+        team.name = "Renamed"
+        team.save()
+        self.assertEqual(grading.cache_get(self.cache, "individual_scores"), 2)
+        self.assertEqual(grading.cache_get(self.cache, "overall_scores"), 2)
+
+    def test_team_change(self):
+        team = Team.objects.get(id=self.teams[0].id)
+        team.division = 2
+        team.save()
+        self.assertIsNone(grading.cache_get(self.cache, "overall_scores"))
+        self.assertIsNone(grading.cache_get(self.cache, "individual_scores"))
+        self.overall_scores()
+        self.individual_scores()
+
+        # Removing a team invalidates its rounds as well
+        Team.objects.get(id=self.teams[3].id).delete()
+        self.assertIsNone(grading.cache_get(self.cache, "overall_scores"))
+
+    def test_invalidate_without_declarations(self):
+        # A process that never imported the grader still invalidates its results
+        with mock.patch.dict(grading.DEPENDENCIES, clear=True):
+            grading.invalidate((grading.ROUND, "team"))
+            self.assertIsNone(grading.cache_get(self.cache, "team_scores"))
+            self.assertIsNone(grading.cache_get(self.cache, "overall_scores"))
+            self.assertEqual(grading.cache_get(self.cache, "individual_scores"), 2)
+
+    def test_stale_while_recomputing(self):
+        self.overall_scores(use_cache=False)
+        grading.invalidate((grading.ROUND, "team"))
+
+        # Another caller is already recomputing, so the stale value is served
+        self.assertTrue(grading.claim(self.cache, "overall_scores"))
+        calls = len(self.calls)
+        self.assertEqual(self.overall_scores(use_stale=True), 2)
+        self.assertEqual(len(self.calls), calls)
+        self.assertFalse(grading.claim(self.cache, "overall_scores"))
+        grading.release(self.cache, "overall_scores")
+        self.assertTrue(grading.claim(self.cache, "overall_scores"))
+
+
+@override_settings(CACHES=CACHES)
+class CommitTests(TransactionTestCase):
+    """Test that grades are only invalidated once answers are committed."""
+
+    def setUp(self):
+        clear_caches()
+        self.cache = {}
+
+        @grading.cached(self.cache, "team_scores", depends_on=[(grading.ROUND, "team")])
+        def team_scores():
+            return 1
+
+        team_scores()
+        self.round = models.Round(ref="team", competition=Competition())
+
+    def test_commit(self):
+        with transaction.atomic():
+            grading.answers_changed(self.round, [])
+            self.assertEqual(grading.cache_get(self.cache, "team_scores"), 1)
+        self.assertIsNone(grading.cache_get(self.cache, "team_scores"))
+
+    def test_rollback(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            grading.answers_changed(self.round, [])
+            raise ValueError
+        self.assertEqual(grading.cache_get(self.cache, "team_scores"), 1)
+
+
+class GraderCacheTests(GradingTestCase):
+    """Test storing grades in a shared cache backend."""
+
+    def test_round_trip(self):
+        cache = grading.GraderCache("test", alias="default")
+        scores = grading.ChillDictionary({1: {self.teams[0]: 1.5}, 2: {self.students[1]: 2.5}})
+        grading.cache_set(cache, "scores", scores)
+        with self.assertNumQueries(2):
+            loaded = grading.cache_get(cache, "scores")
+        self.assertIsInstance(loaded, grading.ChillDictionary)
+        self.assertEqual(loaded, scores)
+        self.assertEqual(next(iter(loaded[2])).team.school.name, "Test School")
+
+    def test_invalidation(self):
+        cache = grading.GraderCache("test", alias="default")
+
+        @grading.cached(cache, "team_scores", depends_on=[(grading.ROUND, "team")])
+        def team_scores():
+            return {self.teams[0]: 1}
+
+        team_scores()
+        self.assertIsNotNone(grading.cache_get(cache, "team_scores"))
+        grading.invalidate((grading.ROUND, "team"))
+        self.assertIsNone(grading.cache_get(cache, "team_scores"))
+
+    def test_file_claims(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        backend = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory.name}
+        with override_settings(CACHES=dict(CACHES, grading=backend)):
+            cache = grading.GraderCache("test", alias="grading")
+            self.assertTrue(grading.claim(cache, "team_scores"))
+            self.assertFalse(grading.claim(cache, "team_scores"))
+            grading.release(cache, "team_scores")
+            self.assertTrue(grading.claim(cache, "team_scores"))
+
+
+class LiveStreamTests(GradingTestCase):
+    """Test the live scoreboard event stream."""
+
+    class Grader(grading.CompetitionGrader):
+        cache = {}
+
+        @grading.cached(cache, "live", depends_on=[(grading.ROUND, "team")])
+        def guts_live_round_scores(self):
+            return self.grade_round(self.competition.rounds.get(ref="team"))
+
+    def test_snapshot(self):
+        grader = self.Grader(self.competition)
+        events = views._live_stream(grader, None)
+        self.assertTrue(next(events).startswith("retry"))
+        snapshot = next(events)
+        self.assertTrue(snapshot.startswith("id: "))
+        self.assertIn("event: snapshot", snapshot)
+        self.assertIn('"{}": ["Cantor", "Team 3", 6.0]'.format(self.teams[3].id), snapshot)
+
+        # Reconnecting with the latest id skips the snapshot
+        event_id = snapshot.split("\n")[0][4:]
+        self.assertEqual(event_id, "{:.6f}".format(grader.guts_live_round_scores.version()[0]))
+
+    def test_stream_limit(self):
+        self.login_staff()
+        grader = property(lambda competition: self.Grader(competition))
+        with mock.patch.object(views, "STREAMS", threading.BoundedSemaphore(1)), \
+                mock.patch.object(Competition, "grader", grader):
+            response = self.client.get(reverse("grading:live_stream", args=["guts"]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get(reverse("grading:live_stream", args=["guts"])).status_code, 503)
+
+            # Closing a stream frees its slot
+            response.close()
+            self.assertTrue(views.STREAMS.acquire(blocking=False))
+
+
+class RunningTotalTests(GradingTestCase):
+    """Test incrementally maintained round totals."""
+
+    class Grader(grading.CompetitionGrader):
+        cache = {}
+        RUNNING_TOTALS = ("team",)
+
+    def test_apply_and_verify(self):
+        grader = self.Grader(self.competition)
+        grader.verify_running_totals(self.team)
+
+        answer = models.Answer.objects.select_related("question__round").filter(
+            team=self.teams[0], question__number=4).first()
+        previous, answer.value = answer.value, 1
+        answer.save()
+        grader.apply_answer_changes([(answer, previous)])
+
+        with self.assertNumQueries(2):
+            totals = grader.running_totals(self.team)
+        self.assertEqual(totals, grader.grade_round(self.team))
+        self.assertEqual(totals[self.teams[0].division][self.teams[0]], 4)
+        self.assertEqual(grader.verify_running_totals(self.team), {})
+
+    def test_missing_total(self):
+        grader = self.Grader(self.competition)
+        changes = []
+        for number in (2, 3):
+            answer = models.Answer.objects.select_related("question__round").get(
+                team=self.teams[0], question__round=self.team, question__number=number)
+            previous, answer.value = answer.value, 1
+            answer.save()
+            changes.append((answer, previous))
+
+        # The first change rebuilds the total, which already counts the second
+        grader.apply_answer_changes(changes)
+        division = self.teams[0].division
+        self.assertEqual(grader.running_totals(self.team)[division][self.teams[0]],
+                         grader.grade_round(self.team)[division][self.teams[0]])
+
+    def test_drift(self):
+        grader = self.Grader(self.competition)
+        grader.verify_running_totals(self.team)
+        models.RoundTotal.objects.filter(team=self.teams[1]).update(value=100)
+        drift = grader.verify_running_totals(self.team)
+        self.assertEqual(drift, {self.teams[1]: (100, 1)})
+        self.assertEqual(grader.running_totals(self.team), grader.grade_round(self.team))
+
+    def test_first_verify(self):
+        grader = self.Grader(self.competition)
+        with mock.patch.object(grading.logger, "warning") as warning:
+            self.assertEqual(grader.verify_running_totals(self.team), {})
+        warning.assert_not_called()
+        self.assertEqual(grader.running_totals(self.team), grader.grade_round(self.team))
+
+    def test_stale_scores(self):
+        grader = self.Grader(self.competition)
+        grader.verify_running_totals(self.team)
+        round = models.Round.objects.get(id=self.team.id)
+        scores = grader.grade_round(round)
+
+        # An answer changed after grading is not reverted by the scores
+        answer = models.Answer.objects.select_related("question__round").filter(
+            team=self.teams[0], question__number=4).first()
+        previous, answer.value = answer.value, 1
+        answer.save()
+        grader.apply_answer_changes([(answer, previous)])
+        self.assertEqual(grader.verify_running_totals(round, scores), {})
+        self.assertEqual(grader.running_totals(round)[self.teams[0].division][self.teams[0]], 4)
+
+
+class GridTests(GradingTestCase):
+    """Test grading a whole round from a single grid."""
+
+    def setUp(self):
+        super().setUp()
+        self.login_staff()
+
+    def test_grid_view(self):
+        response = self.client.get(reverse("grading:grid", args=["team"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["rows"]), len(self.teams))
+
+    def test_bulk_save(self):
+        question = self.team.questions.get(number=4)
+        team = self.teams[0]
+        models.Answer.objects.filter(team=team, question=question).delete()
+        changed = self.team.questions.get(number=1)
+        response = self.client.post(reverse("grading:grid", args=["team"]), {
+            "{}-{}".format(team.id, question.id): "1",
+            "{}-{}".format(team.id, changed.id): "",
+            "{}-{}".format(self.teams[1].id, changed.id): "1"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(models.Answer.objects.get(team=team, question=question).value, 1)
+        self.assertIsNone(models.Answer.objects.get(team=team, question=changed).value)
+
+    def test_invalid_value(self):
+        question = self.team.questions.get(number=1)
+        response = self.client.post(reverse("grading:grid", args=["team"]), {
+            "{}-{}".format(self.teams[0].id, question.id): "x",
+            "{}-{}".format(self.teams[1].id, question.id): "0"})
+        self.assertEqual(len(response.context["errors"]), 1)
+
+        # Submitted values are shown again rather than the saved ones
+        self.assertContains(response, 'value="x" data-saved="0.0"')
+        self.assertContains(response, 'value="0" data-saved="1.0"')
+
+
+class ImportTests(GradingTestCase):
+    """Test importing answers from scanner output."""
+
+    def test_csv_import(self):
+        lines = [
+            "team,student,round,question,value",
+            "{},,team,4,1".format(self.teams[0].number),
+            ",{},subject1,1,1".format(self.students[0].id),
+            "99,,team,1,1",
+            "{},,team,9,1".format(self.teams[0].number),
+            "{},,team,1,x".format(self.teams[0].number)]
+        report = importing.import_answers(self.competition, lines)
+        self.assertEqual(report.rows, 5)
+        self.assertEqual(report.written, 2)
+        self.assertEqual([line for line, _ in report.errors], [4, 5, 6])
+        self.assertEqual(models.Answer.objects.get(team=self.teams[0], question__round=self.team,
+                                                   question__number=4).value, 1)
+
+        # Importing the same file again writes nothing
+        self.assertEqual(importing.import_answers(self.competition, lines).written, 0)
+
+    def test_json_import(self):
+        lines = [
+            '{{"student": {}, "round": "subject1", "question": 2, "value": ""}}'.format(self.students[2].id),
+            "not json"]
+        report = importing.import_answers(self.competition, lines, batch_size=1)
+        self.assertEqual(report.written, 1)
+        self.assertEqual(len(report.errors), 1)
+        self.assertIsNone(models.Answer.objects.get(student=self.students[2], question__number=2).value)
+
+    def test_upload(self):
+        self.login_staff()
+        upload = SimpleUploadedFile("answers.csv", "team,round,question,value\n1,team,4,1\n".encode())
+        response = self.client.post(reverse("grading:import"), {"file": upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["report"].written, 1)
+
+
+class GradingStatusTests(GradingTestCase):
+    """Test annotating list views with their grading status."""
+
+    def test_annotation_matches_filter(self):
+        students = list(Student.objects.filter(id__in=[student.id for student in self.students]))
+        with self.assertNumQueries(1):
+            annotated = annotate_grading_status(students, ("subject1", "subject2"))
+        with self.assertNumQueries(0):
+            tags = [grading_status(student, "subject1") for student in annotated]
+        for student, tag in zip(Student.objects.filter(id__in=[student.id for student in self.students]), tags):
+            self.assertEqual(grading_status(student, self.individual), tag)
+
+    def test_list_query_count(self):
+        self.login_staff()
+        Competition.current()
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse("grading:students"))
+        self.assertEqual(len(response.context["students"]), len(self.students))
+
+
+class KeysetPaginationTests(GradingTestCase):
+    """Test searching and paging through the grading lists."""
+
+    def setUp(self):
+        super().setUp()
+        self.login_staff()
+
+    def test_pages(self):
+        paginate_by = views.TeamsView.paginate_by
+        views.TeamsView.paginate_by = 3
+        try:
+            first = self.client.get(reverse("grading:teams")).context
+            self.assertEqual([team.number for team in first["teams"]], [0, 1, 2])
+            self.assertIsNone(first["previous"])
+            second = self.client.get(reverse("grading:teams"), {"after": first["next"]}).context
+            self.assertEqual([team.number for team in second["teams"]], [3])
+            self.assertIsNone(second["next"])
+            back = self.client.get(reverse("grading:teams"), {"before": second["previous"]}).context
+            self.assertEqual([team.number for team in back["teams"]], [0, 1, 2])
+            self.assertIsNone(back["previous"])
+        finally:
+            views.TeamsView.paginate_by = paginate_by
+
+    def test_search(self):
+        response = self.client.get(reverse("grading:students"), {"search": "student 21"})
+        self.assertEqual([student.last_name for student in response.context["students"]], ["21"])
+        response = self.client.get(reverse("grading:teams"), {"search": "2"})
+        self.assertEqual([team.number for team in response.context["teams"]], [2])
+
+        # Names are matched by prefix, ignoring case
+        self.assertEqual(len(self.client.get(reverse("grading:teams"), {"search": "tea"}).context["teams"]), 4)
+        self.assertEqual(len(self.client.get(reverse("grading:teams"), {"search": "TEA"}).context["teams"]), 4)
+        response = self.client.get(reverse("grading:students"), {"search": "STUDENT"})
+        self.assertEqual(len(response.context["students"]), len(self.students))
+        self.assertEqual(len(self.client.get(reverse("grading:teams"), {"search": "eam"}).context["teams"]), 0)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(reverse("grading:teams"), {"after": "abc"}).status_code, 404)
+        self.assertEqual(self.client.get(reverse("grading:students"), {"before": "-1"}).status_code, 404)
+
+
+class StatisticsTests(GradingTestCase):
+    """Test aggregating answer statistics by question."""
+
+    def test_round_statistics(self):
+        with self.assertNumQueries(1):
+            stats = statistics.round_statistics(self.individual)
+        expected = {}
+        for i, student in enumerate(self.students):
+            for answer in student.answers.select_related("question"):
+                counts = expected.setdefault((student.team.division, "al"), {}).setdefault(
+                    answer.question.number, [0, 0, 0])
+                counts[2 if answer.value is None else 1 - int(answer.value)] += 1
+        self.assertEqual({key: dict(value) for key, value in stats.counts.items()}, expected)
+
+    def test_estimation_guesses(self):
+        question = models.Question.new(self.team, 5, label="5", type=models.ESTIMATION)
+        for i, team in enumerate(self.teams):
+            models.Answer.objects.create(question=question, team=team, value=i // 2)
+        stats = statistics.round_statistics(self.team)
+        self.assertEqual(stats.estimations(1), [(5, {0: 1, 1: 1})])
+        self.assertNotIn(5, dict(stats.questions(1)))
+
+    def test_view(self):
+        self.login_staff()
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse("grading:statistics"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_table_kept_up_to_date(self):
+        def rows():
+            return sorted(models.QuestionStatistics.objects.values_list(
+                "question_id", "division", "subject", "correct", "incorrect", "blank", "attending", "attending_value"))
+
+        answer = models.Answer.objects.filter(student=self.students[1], value__isnull=False).first()
+        answer.value = 1 - answer.value
+        answer.save()
+        models.Answer.objects.filter(student=self.students[2]).first().delete()
+        models.Answer.objects.create(question=self.team.questions.first(), team=self.teams[0], value=None)
+        student = Student.objects.get(id=self.students[4].id)
+        student.attending = False
+        student.save()
+
+        updated = rows()
+        for round in (self.individual, self.team):
+            statistics.rebuild_question_statistics(round)
+        self.assertEqual(updated, rows())
+
+    def test_attending_counts(self):
+        student = Student.objects.get(id=self.students[4].id)
+        student.attending = False
+        student.save()
+        expected = {}
+        for answer in models.Answer.objects.filter(question__round=self.individual, student__attending=True):
+            counts = expected.setdefault((answer.student.team.division, "al", answer.question.number), [0, 0])
+            counts[0] += answer.value or 0
+            counts[1] += 1
+        with self.assertNumQueries(1):
+            self.assertEqual(statistics.attending_counts(self.individual), expected)
+
+
+class ScoreCombinationTests(GradingTestCase):
+    """Test standardizing and weighting scores by division."""
+
+    def test_z_score(self):
+        grader = grading.CompetitionGrader(self.competition)
+        raw = grader.grade_round(self.team)
+        scores = grader.z_score(raw)
+        for division in raw:
+            data = list(raw[division].values())
+            average, dev = mean(data), stdev(data)
+            for team in raw[division]:
+                self.assertAlmostEqual(scores[division][team], (raw[division][team] - average) / dev)
+
+    def test_combine_scores(self):
+        grader = grading.CompetitionGrader(self.competition)
+        first = {1: {self.teams[0]: 1.0, self.teams[2]: 2.0}}
+        second = {1: {self.teams[0]: 3.0}, 2: {self.teams[1]: 4.0}}
+        combined = grader.combine_scores(self.teams, ((0.5, first), (0.25, second)))
+        self.assertEqual(combined, {
+            1: {self.teams[0]: 1.25, self.teams[2]: 1.0},
+            2: {self.teams[1]: 1.0, self.teams[3]: 0.0}})
+
+    def test_processes(self):
+        grader = grading.CompetitionGrader(self.competition)
+        raw = grader.grade_round(self.team)
+        serial = grader.z_score(raw)
+        score_sets = [[0.5, 0.25, 1], [1, 0, 0.5, 0.75], [0.1, 0.2, 0.3]]
+        exponents = grading.solve_power_averages(score_sets, 0.375)
+
+        # Work in worker processes is merged back in the same order
+        with mock.patch.object(grading, "PROCESSES", 2):
+            pool = grading.process_pool()
+            self.addCleanup(grading.POOL.clear)
+            self.addCleanup(pool.shutdown)
+            self.assertEqual(grader.z_score(raw), serial)
+            solved = grading.map_divisions(grading.solve_power_averages, {
+                division: ([score_sets[i]], 0.375) for division, i in ((2, 0), (1, 1), (3, 2))})
+        self.assertEqual(list(solved), [2, 1, 3])
+        self.assertEqual([solved[2][0], solved[1][0], solved[3][0]], exponents)
+
+
+class GraderPlanTests(GradingTestCase):
+    """Test compiling question graders into a plan."""
+
+    def test_plan(self):
+        grader = grading.CompetitionGrader(self.competition)
+
+        def first(question, answer):
+            return 1
+
+        def second(question, answer):
+            return 2
+
+        grader.register_question_grader(grading.Q(round=self.team), first)
+        grader.register_question_grader(grading.Q(round=self.team, number=4), second)
+        with self.assertNumQueries(4):
+            plan = grader.plan
+        round_plan = plan.rounds[self.team.id]
+        self.assertEqual([question.number for question in round_plan.questions], [1, 2, 3, 4])
+        self.assertEqual(round_plan.graders, [first, first, first, second])
+        self.assertEqual(round_plan.weights.tolist(), [1, 2, 3, 4])
+        self.assertEqual(list(plan.conflicts.values()), [["first", "second"]])
+
+    def test_view(self):
+        Competition.objects.filter(id=self.competition.id).update(_grader="competitions.mbmt2019.grading")
+        Competition.forget_current()
+        self.addCleanup(grading.graders.clear)
+
+        self.login_staff()
+        response = self.client.get(reverse("grading:plan"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "subject1_question_grader")
+        self.assertContains(response, "default_question_grader")
+
+
+class GraderRegistryTests(GradingTestCase):
+    """Test keeping a grader per competition."""
+
+    def setUp(self):
+        super().setUp()
+        self.competition._grader = "competitions.mbmt2019.grading"
+        self.registry = grading.GraderRegistry(size=1)
+
+    def test_rebuild(self):
+        grader = self.registry.get(self.competition)
+        self.assertIs(self.registry.get(self.competition), grader)
+        self.assertIs(grader.competition, self.competition)
+
+        # Changing a question rebuilds the grader and its plan
+        question = self.team.questions.get(number=1)
+        question.weight = 5
+        question.save()
+        rebuilt = self.registry.get(self.competition)
+        self.assertIsNot(rebuilt, grader)
+        self.assertEqual(rebuilt.plan.rounds[self.team.id].weights.tolist(), [5, 2, 3, 4])
+
+    def test_eviction(self):
+        other = Competition.objects.get(id=self.competition.id)
+        other.id, other.active = None, False
+        other.save()
+        other._grader = self.competition._grader
+
+        # The active competition outlives a more recently used one
+        active = self.registry.get(self.competition)
+        self.registry.get(other)
+        self.assertIs(self.registry.get(self.competition), active)
+        self.assertEqual(len(self.registry.graders), 1)
+
+        # Once another competition is activated, the old grader can go
+        # even though the competition it holds still reads as active
+        other.activate()
+        self.assertIsNot(self.registry.get(other), active)
+        self.assertEqual(list(self.registry.graders), [(other.id, other._grader)])
+
+    def test_scoped_cache(self):
+        other = Competition.objects.get(id=self.competition.id)
+        other.id = None
+        other.save()
+
+        class Grader(grading.CompetitionGrader):
+            cache = grading.GraderCache("registry", alias="default")
+
+            @grading.cached(cache, "team_scores", depends_on=[(grading.ROUND, "team")])
+            def team_scores(self):
+                return {self.competition.id: 1}
+
+        first, second = Grader(self.competition), Grader(other)
+        self.assertEqual(first.team_scores(), {self.competition.id: 1})
+        self.assertEqual(second.team_scores(), {other.id: 1})
+        self.assertIsNotNone(first.team_scores.version())
+        grading.invalidate((grading.ROUND, "team"))
+        self.assertIsNone(first.cache_get("team_scores"))
+        self.assertIsNone(second.cache_get("team_scores"))
+
+    def test_scoped_invalidation(self):
+        class Grader(grading.CompetitionGrader):
+            cache = grading.GraderCache("registry", alias="default")
+
+            @grading.cached(cache, "team_scores", depends_on=[(grading.ROUND, "team")])
+            def team_scores(self):
+                return {self.competition.id: 1}
+
+        grader = Grader(self.competition)
+        grader.team_scores()
+
+        # Invalidate from a process that never scoped a container
+        with mock.patch.dict(grading.SCOPES, clear=True), mock.patch.dict(grading.DEPENDENCIES, clear=True):
+            grading.invalidate((grading.ROUND, "team"))
+        self.assertIsNone(grader.cache_get("team_scores"))
+
+
+class SnapshotTests(GradingTestCase):
+    """Test persisting scoreboard results by answer version."""
+
+    class Grader(grading.CompetitionGrader):
+        cache = grading.GraderCache("snapshot", alias="default")
+        calls = 0
+
+        @grading.cached(cache, "team_scores", depends_on=[(grading.ROUND, "team")])
+        def team_round_grader(self, round):
+            SnapshotTests.Grader.calls += 1
+            return self.grade_round(round)
+
+    def setUp(self):
+        super().setUp()
+        self.Grader.calls = 0
+
+    def grade(self):
+        grader = self.Grader(self.competition)
+        version = snapshots.restore(grader)
+        scores = grader.team_round_grader(self.team, use_cache=True)
+        snapshots.record(grader, version)
+        return scores
+
+    def test_restore(self):
+        scores = self.grade()
+        self.assertEqual(models.ScoreboardSnapshot.objects.count(), 1)
+
+        # A cold cache is filled from the snapshot instead of regrading
+        caches["default"].clear()
+        self.assertEqual(self.grade(), scores)
+        self.assertEqual(self.Grader.calls, 1)
+        self.assertEqual(models.ScoreboardSnapshot.objects.count(), 1)
+
+    def test_recorded(self):
+        self.grade()
+        grader = self.Grader(self.competition)
+        version = snapshots.answer_version(self.competition)
+
+        # Outputs already recorded are checked without loading them
+        with self.assertNumQueries(2):
+            snapshots.record(grader, version)
+        self.assertEqual(snapshots.cached_names(grader), {"team_scores"})
+
+    def test_version(self):
+        self.grade()
+        answer = models.Answer.objects.get(team=self.teams[0], question__round=self.team, question__number=1)
+        answer.value = 1
+        answer.save()
+
+        # Changed answers are regraded and snapshotted under a new version
+        caches["default"].clear()
+        scores = self.grade()
+        self.assertEqual(self.Grader.calls, 2)
+        self.assertEqual(scores[self.teams[0].division][self.teams[0]], 1)
+
+        old, new = models.ScoreboardSnapshot.objects.order_by("version")
+        self.assertEqual(new.version, old.version + 1)
+        changes = snapshots.diff(old, new)
+        path = (self.teams[0].division, grading.Ref("coaches.Team", self.teams[0].id))
+        self.assertEqual(changes, {"team_scores": {path: (0, 1)}})
+
+
+class MemoizationTests(GradingTestCase):
+    """Test memoizing grader outputs by a checksum of their inputs."""
+
+    class Grader(grading.CompetitionGrader):
+        cache = grading.GraderCache("memo", alias="default")
+        calls = 0
+
+        @grading.cached(cache, "team_scores", depends_on=[(grading.ROUND, "team")])
+        def team_round_grader(self, round):
+            MemoizationTests.Grader.calls += 1
+            scores = self.grade_round(round)
+            self.cache_set("raw_team_scores", scores, depends_on=["team_scores"])
+            return scores
+
+        @grading.cached(cache, "individual_scores", depends_on=[(grading.ROUND, "subject1"), grading.ATTENDANCE])
+        def calculate_individual_scores(self):
+            MemoizationTests.Grader.calls += 1
+            return self.grade_round(self.competition.rounds.get(ref="subject1"))
+
+        @grading.cached(cache, "team_overall_scores", depends_on=["individual_scores", "team_scores"])
+        def calculate_team_scores(self):
+            individual = self.calculate_individual_scores()
+            team = self.team_round_grader(self.competition.rounds.get(ref="team"))
+            return {division: sum(individual[division].values()) + sum(team[division].values())
+                    for division in team}
+
+    def setUp(self):
+        super().setUp()
+        self.Grader.calls = 0
+        self.grader = self.Grader(self.competition)
+
+    def test_unchanged(self):
+        scores = self.grader.team_round_grader(self.team, use_cache=False)
+
+        # Saving an unchanged answer invalidates but restores from the memo
+        models.Answer.objects.filter(team=self.teams[1], question__round=self.team).first().save()
+        self.assertIsNone(self.grader.cache_get("raw_team_scores"))
+        self.assertEqual(self.grader.team_round_grader(self.team), scores)
+        self.assertEqual(self.grader.cache_get("raw_team_scores"), scores)
+        self.assertEqual(self.Grader.calls, 1)
+
+        # Recalculating by hand always regrades
+        self.assertEqual(self.grader.team_round_grader(self.team, use_cache=False), scores)
+        self.assertEqual(self.Grader.calls, 2)
+
+    def test_division_change(self):
+        self.grader.team_round_grader(self.team)
+        Team.objects.filter(id=self.teams[0].id).update(division=2)
+        grading.invalidate((grading.ROUND, "team"))
+        scores = self.grader.team_round_grader(self.team)
+        self.assertEqual(self.Grader.calls, 2)
+        self.assertIn(self.teams[0].id, {team.id for team in scores[2]})
+
+    def test_stale_upstream(self):
+        overall = self.grader.calculate_team_scores()
+        self.assertEqual(self.Grader.calls, 2)
+
+        # Attendance is invalidated without changing, so the memo of the
+        # overall scores only applies once individual scores are restored
+        grading.invalidate(grading.ATTENDANCE)
+        self.assertEqual(self.grader.calculate_team_scores(), overall)
+        self.assertIsNotNone(self.grader.cache_get("individual_scores"))
+        self.assertIsNotNone(self.grader.cache_get("team_scores"))
+        self.assertIsNotNone(self.grader.cache_get("team_overall_scores"))
+        self.assertEqual(self.Grader.calls, 2)
+
+    def test_changed(self):
+        self.grader.team_round_grader(self.team, use_cache=False)
+        answer = models.Answer.objects.get(team=self.teams[0], question__round=self.team, question__number=2)
+        answer.value = 1
+        answer.save()
+        scores = self.grader.team_round_grader(self.team, use_cache=False)
+        self.assertEqual(scores[self.teams[0].division][self.teams[0]], 2)
+        self.assertEqual(self.Grader.calls, 2)
+
+        # The checksum is maintained incrementally
+        checksum = models.Round.objects.get(id=self.team.id).checksum
+        expected = sum(grading.answer_checksum(answer, answer.value)
+                       for answer in models.Answer.objects.filter(question__round=self.team))
+        self.assertEqual(checksum, expected)
+
+
+class JobTests(GradingTestCase):
+    """Test recalculating scoreboards in the background."""
+
+    def test_coalesce(self):
+        executor = jobs.Executor(workers=1)
+        release = threading.Event()
+        calls = []
+
+        def recalculate():
+            calls.append(1)
+            release.wait(5)
+
+        job = executor.submit("team", recalculate)
+        self.assertIs(executor.submit("team", recalculate), job)
+        self.assertTrue(job.running)
+        release.set()
+        self.assertTrue(job.wait(5))
+        self.assertFalse(job.running)
+        self.assertEqual(len(calls), 1)
+        last = executor.submit("team", lambda: None)
+        self.assertIsNot(last, job)
+        self.assertTrue(last.wait(5))
+
+    def test_other_process(self):
+        executor, other = jobs.Executor(workers=1), jobs.Executor(workers=1)
+        release = threading.Event()
+        calls = []
+
+        def recalculate():
+            calls.append(1)
+            release.wait(5)
+
+        # A job running in one process is seen by, and not started again in, another
+        job = executor.submit("team", recalculate)
+        self.assertTrue(other.status("team").running)
+        self.assertTrue(other.submit("team", recalculate).running)
+        release.set()
+        self.assertTrue(job.wait(5))
+        self.assertFalse(other.status("team").running)
+        self.assertEqual(len(calls), 1)
+
+    def test_abandoned(self):
+        jobs.JOBS["team"] = {"submitted": 0, "started": 0, "finished": None, "error": None}
+        job = jobs.Executor(workers=0).status("team")
+        self.assertFalse(job.running)
+        self.assertIn("abandoned", job.error)
+
+    def test_error(self):
+        job = jobs.Executor(workers=0).submit("team", lambda: 1 / 0)
+        self.assertFalse(job.running)
+        self.assertIn("ZeroDivisionError", job.error)
+
+    def test_view(self):
+        self.login_staff()
+        Competition.objects.filter(id=self.competition.id).update(_grader="competitions.mbmt2019.grading")
+        Competition.forget_current()
+        self.addCleanup(grading.graders.clear)
+
+        # A running job is shown instead of grading alongside it
+        job = jobs.Job((self.competition.id, "team"))
+        with mock.patch.dict(jobs.executor.jobs, {job.key: job}):
+            response = self.client.get(reverse("grading:scoreboard_teams"))
+            self.assertContains(response, "Computing")
+            response = self.client.post(reverse("grading:scoreboard_teams"), {"recalculate": ""})
+            self.assertRedirects(response, reverse("grading:scoreboard_teams"))
+            self.assertIs(jobs.executor.status(job.key), job)
+
+
+class GradeCommandTests(GradingTestCase):
+    """Test grading a competition offline."""
+
+    def setUp(self):
+        super().setUp()
+        subject2 = models.Round.new(self.competition, "subject2", name="Individual 2", grouping=models.INDIVIDUAL)
+        guts = models.Round.new(self.competition, "guts", name="Guts", grouping=models.TEAM)
+        for round in (subject2, guts):
+            for number in range(1, 5):
+                models.Question.new(round, number, label=str(number), type=models.CORRECT, weight=1)
+
+        # Students of each division answer one to four questions of each round
+        divisions = {}
+        for student in self.students:
+            division = divisions.setdefault(student.team.division, [])
+            division.append(student)
+            for answer in models.Answer.objects.filter(student=student, question__round=self.individual):
+                answer.value = int(answer.question.number <= len(division))
+                answer.save()
+            for question in subject2.questions.all():
+                models.Answer.objects.create(
+                    question=question, student=student, value=int(question.number <= len(division)))
+        for i, team in enumerate(self.teams):
+            for question in guts.questions.all():
+                models.Answer.objects.create(question=question, team=team, value=int(question.number > i))
+
+        Competition.objects.filter(id=self.competition.id).update(_grader="competitions.mbmt2019.grading")
+        Competition.forget_current()
+        self.addCleanup(grading.graders.clear)
+
+    def test_grade(self):
+        with tempfile.TemporaryDirectory() as directory:
+            call_command("competition", "grade", "--output", directory, "--format", "csv")
+            call_command("competition", "grade", "--competition", str(self.competition.id), "--output", directory)
+            directory = os.path.join(directory, "{}-mbmt-test".format(self.competition.id))
+            with open(os.path.join(directory, "teams.csv")) as file:
+                rows = list(csv.DictReader(file))
+            with open(os.path.join(directory, "intermediate.json")) as file:
+                intermediate = json.load(file)
+
+        self.assertEqual(sorted(row["name"] for row in rows), sorted(team.name for team in self.teams))
+        self.assertEqual([row["rank"] for row in rows if row["division"] == rows[0]["division"]], ["1", "2"])
+        raw = intermediate["raw_team_scores"]
+        self.assertEqual(raw[str(self.teams[3].division)][str(self.teams[3].id)], 6)
+
+    def test_missing_output(self):
+        grader = Competition.objects.get(id=self.competition.id).grader
+        with self.assertRaisesRegex(ValueError, "team_scores"):
+            exporting.scoreboards(exporting.graded_outputs(grader, 0, individual_scores={}))
@@ -11,7 +11,10 @@ urlpatterns = [
     url(r"^grade/students/$", views.StudentsView.as_view(), name="students"),
     url(r"^grade/teams/$", views.TeamsView.as_view(), name="teams"),
     url(r"^grade/(?P<grouping>\w+)/(?P<any_id>\d+)/(?P<round_id>\w+)/$", views.score, name="score"),
+    url(r"^grade/grid/(?P<round_id>\w+)/$", views.grid, name="grid"),
+    url(r"^grade/import/$", views.import_answers, name="import"),
     url(r"^grade/statistics/$", views.statistics, name="statistics"),
+    url(r"^grade/plan/$", views.grader_plan, name="plan"),
 
     # Logistics
     url(r"^attendance/$", views.attendance, name="attendance"),
@@ -26,6 +29,7 @@ urlpatterns = [
     url(r"^scoreboard/students/$", views.student_scoreboard, name="scoreboard_students"),
     url(r"^scoreboard/teams/$", views.team_scoreboard, name="scoreboard_teams"),
     url(r"^live/(?P<round_id>\w+)/update/$", views.live_update, name="live_update"),
+    url(r"^live/(?P<round_id>\w+)/stream/$", views.live_stream, name="live_stream"),
     url(r"^live/(?P<round_id>\w+)/$", views.live, name="live"),
 
     # Sponsor scores
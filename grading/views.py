@@ -4,18 +4,25 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views import View
 from django.views.generic import ListView
 from django.shortcuts import render, redirect, HttpResponse
+from django.http import StreamingHttpResponse, Http404
 from django.db.models import Q
+from django.conf import settings
 
 import json
 import math
+import time
+import threading
+import codecs
 import collections
 import itertools
 import traceback
 
 from home.models import User, Competition
 from coaches.models import Coaching, Student, Team, Chaperone, DIVISIONS_MAP, DIVISIONS, SUBJECTS
-from .models import Round, Question, Answer, ESTIMATION
-from . import grading
+from .models import Round, Question, Answer, INDIVIDUAL
+from .templatetags.grading_status import annotate_grading_status
+from . import grading, importing, jobs, snapshots
+from . import statistics as statistics_engine
 
 
 # Staff check
@@ -44,43 +51,120 @@ def index(request):
         "coaching": Coaching.current().all()})
 
 
-class StudentsView(ListView, StaffMemberRequired):
+class KeysetListView(ListView, StaffMemberRequired):
+    """List view paginated by the ordering key instead of an offset.
+
+    Pages are addressed by the id of the row just before or after them,
+    so each page is a single indexed range query no matter how deep the
+    grader has paged. Searches match a prefix of lower-cased key columns
+    case sensitively, which their indexes can serve, unlike `istartswith`.
+    """
+
+    paginate_by = 50
+    keys = ("id",)
+
+    def search(self, queryset, search: str):
+        """Filter the queryset by a search string."""
+
+        return queryset
+
+    def current(self):
+        """Get the rows of the active competition to list."""
+
+        return super().get_queryset()
+
+    def get_queryset(self):
+        queryset = self.current()
+        search = self.request.GET.get("search", "").strip()
+        if search:
+            queryset = self.search(queryset, search)
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        """Get the page after or before the row given in the request."""
+
+        after = self.request.GET.get("after")
+        before = self.request.GET.get("before") if after is None else None
+        cursor = after or before
+        if cursor is not None:
+            if not cursor.isdigit():
+                raise Http404("Invalid page")
+            boundary = queryset.model.objects.filter(id=cursor).values_list(*self.keys).first()
+            if boundary is not None:
+                queryset = queryset.filter(self.keyset(boundary, "gt" if after else "lt"))
+
+        if before:
+            queryset = queryset.order_by(*("-" + key for key in self.keys))
+        else:
+            queryset = queryset.order_by(*self.keys)
+        objects = list(queryset[:page_size + 1])
+        more = len(objects) > page_size
+        del objects[page_size:]
+        if before:
+            objects.reverse()
+
+        self.next = objects[-1].id if objects and (more or before) else None
+        self.previous = objects[0].id if objects and (after or before and more) else None
+        return None, None, objects, bool(self.next or self.previous)
+
+    def keyset(self, boundary, lookup: str):
+        """Match rows ordered strictly after or before a boundary key."""
+
+        condition = Q()
+        for i, key in enumerate(self.keys):
+            equal = {self.keys[j]: boundary[j] for j in range(i)}
+            condition |= Q(**equal, **{key + "__" + lookup: boundary[i]})
+        return condition
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["next"] = self.next
+        context["previous"] = self.previous
+        context["search"] = self.request.GET.get("search", "")
+        return context
+
+
+class StudentsView(KeysetListView):
     """Get the list of all students for grading."""
 
     template_name = "grading/student/view.html"
     context_object_name = "students"
-    paginate_by = 50
+    keys = ("last_name", "id")
 
-    def get_queryset(self):
-        students = Student.current().order_by("last_name").all()
-        if "search" in self.request.GET:
-            search = self.request.GET["search"].lower()
-            return list(filter(lambda student: search in student.get_full_name().lower(), students))
-        return students
+    def current(self):
+        return Student.current().select_related("team__school")
+
+    def search(self, queryset, search: str):
+        for term in search.lower().split():
+            queryset = queryset.filter(Q(first_name_key__startswith=term) | Q(last_name_key__startswith=term))
+        return queryset
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["total"] = Student.current().count()
+        context["students"] = annotate_grading_status(context["students"], ("subject1", "subject2"))
         return context
 
 
-class TeamsView(ListView, StaffMemberRequired):
-    """Get the list of all students for grading."""
+class TeamsView(KeysetListView):
+    """Get the list of all teams for grading."""
 
     template_name = "grading/team/view.html"
     context_object_name = "teams"
-    paginate_by = 50
+    keys = ("number", "id")
 
-    def get_queryset(self):
-        teams = Team.current().order_by("number").all()
-        if "search" in self.request.GET:
-            search = self.request.GET["search"].lower()
-            return list(filter(lambda team: search in team.name.lower() or str(team.number) == search, teams))
-        return teams
+    def current(self):
+        return Team.current().select_related("school")
+
+    def search(self, queryset, search: str):
+        if search.isdigit():
+            return queryset.filter(Q(name_key__startswith=search) | Q(number=int(search)))
+        return queryset.filter(name_key__startswith=search.lower())
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["total"] = Team.current().count()
+        context["teams"] = annotate_grading_status(context["teams"], ("team", "guts"))
         return context
 
 
@@ -103,19 +187,16 @@ def score_team(request, team_id, round):
 
     # Iterate questions and get answers
     team = Team.objects.filter(id=team_id).first()
-    answers = []
+    answers = {answer.question_id: answer for answer in Answer.objects.filter(team=team, question__round=round)}
     question_answer = []
     for question in round.questions.order_by("number").all():
-        answer = Answer.objects.filter(team=team, question=question).first()
-        if not answer:
-            answer = Answer(team=team, question=question)
-            answer.save()
-        answers.append(answer)
+        answer = answers.get(question.id) or Answer(team=team, question=question)
+        answer.question = question
         question_answer.append((question, answer))
 
     # Update the answers
     if request.method == "POST":
-        update_answers(request, answers)
+        update_answers(request, round, question_answer)
         return redirect("grading:teams")
 
     # Render the grading view
@@ -132,20 +213,17 @@ def score_individual(request, student_id, round):
     """Scoring view for an individual."""
 
     # Iterate questions and get answers
-    student = Student.objects.filter(id=student_id).first()
-    answers = []
+    student = Student.objects.filter(id=student_id).select_related("team").first()
+    answers = {answer.question_id: answer for answer in Answer.objects.filter(student=student, question__round=round)}
     question_answer = []
     for question in round.questions.order_by("number").all():
-        answer = Answer.objects.filter(student=student, question=question).first()
-        if not answer:
-            answer = Answer(student=student, question=question)
-            answer.save()
-        answers.append(answer)
+        answer = answers.get(question.id) or Answer(student=student, question=question)
+        answer.question = question
         question_answer.append((question, answer))
 
     # Update the answers
     if request.method == "POST":
-        update_answers(request, answers)
+        update_answers(request, round, question_answer)
         return redirect("grading:students")
 
     # Render the grading view
@@ -158,16 +236,99 @@ def score_individual(request, student_id, round):
 
 
 @staff_member_required
-def update_answers(request, answers):
-    """Update the answers to a round by an individual or group."""
+def update_answers(request, round, question_answer):
+    """Update the answers to a round by an individual or group.
+
+    Every answer is saved, including blank ones, so that partially
+    graded rounds show up as such.
+    """
 
-    for answer in answers:
-        id = str(answer.question.id)
+    values = []
+    for question, answer in question_answer:
+        id = str(question.id)
         if id in request.POST:
-            value = None if str(request.POST[id]) == "" else float(request.POST[id])
-            if answer.value != value:
-                answer.value = value
-                answer.save()
+            values.append((answer, None if str(request.POST[id]) == "" else float(request.POST[id])))
+        elif answer.pk is None:
+            values.append((answer, None))
+    grading.save_answers(round, values)
+
+
+@staff_member_required
+def grid(request, round_id):
+    """Grade every team, or every student taking a subject, in a round at once.
+
+    Cells are named by the id of the team or student and the question,
+    and submitting the grid writes every changed cell in one transaction.
+    The page only submits cells that differ from their saved value, and
+    cells that are not submitted are left alone. If any cell is not a
+    number, the grid is shown again with the values as submitted.
+    """
+
+    competition = Competition.current()
+    round = competition.rounds.filter(ref=round_id).first()
+    if round is None:
+        return redirect("grading:index")
+
+    questions = list(round.questions.order_by("number"))
+    subject = request.GET.get("subject")
+    if round.grouping == INDIVIDUAL:
+        things = Student.current(attending=True).select_related("team").order_by("last_name", "first_name")
+        if subject:
+            things = things.filter(**{round.ref: subject})
+    else:
+        things = Team.current().order_by("number")
+    if request.GET.get("division"):
+        division = ("team__" if round.grouping == INDIVIDUAL else "") + "division"
+        things = things.filter(**{division: request.GET["division"]})
+
+    answers = grading.AnswerMatrix(round, questions)
+    group = answers.group
+    rows = []
+    values = []
+    errors = []
+    for thing in things:
+        cells = []
+        for question in questions:
+            answer = answers.get(thing.id, question.number) or Answer(question=question, **{group: thing})
+            name = "{}-{}".format(thing.id, question.id)
+            saved = "" if answer.value is None else str(answer.value)
+            cells.append((question, name, saved, request.POST.get(name, saved)))
+
+            if request.method == "POST" and name in request.POST:
+                value = request.POST[name].strip()
+                try:
+                    value = None if value == "" else float(value)
+                except ValueError:
+                    errors.append("{}, question {}: {} is not a number".format(thing.name, question.label, value))
+                    continue
+                if answer.pk is not None or value is not None:
+                    values.append((answer, value))
+        rows.append((thing, cells))
+
+    if request.method == "POST" and not errors:
+        grading.save_answers(round, values)
+        return redirect(request.get_full_path())
+
+    return render(request, "grading/grid.html", {
+        "round": round,
+        "questions": questions,
+        "rows": rows,
+        "subject": subject,
+        "subjects": SUBJECTS,
+        "divisions": DIVISIONS,
+        "errors": errors})
+
+
+@staff_member_required
+def import_answers(request):
+    """Import graded answers from an uploaded CSV or JSON lines file."""
+
+    report = None
+    if request.method == "POST" and "file" in request.FILES:
+        lines = codecs.iterdecode(request.FILES["file"], "utf-8")
+        report = importing.import_answers(Competition.current(), lines, request.POST.get("format") or None)
+
+    return render(request, "grading/import.html", {"report": report})
 
 
 @login_required
@@ -276,7 +437,7 @@ def live_update(request, round_id):
 
     if round_id == "guts":
         grader = Competition.current().grader
-        scores = grader.guts_live_round_scores(use_cache_before=20)
+        scores = grader.guts_live_round_scores(use_stale=True)
         named_scores = dict()
         for division in scores:
             division_name = DIVISIONS_MAP[division]
@@ -288,11 +449,128 @@ def live_update(request, round_id):
         return HttpResponse("{}")
 
 
+# Server-sent events for the live guts scoreboard. Each stream holds a
+# worker thread while open, so streams end after half a minute and the
+# browser reconnects with the id of the last event it received, letting
+# other requests take the thread in between. Streams need a threaded or
+# asynchronous worker class, and at most LIVE_STREAM_LIMIT are open per
+# process so that they cannot take every thread; browsers refused one
+# poll instead.
+STREAM_INTERVAL = 0.5
+STREAM_DURATION = 25
+STREAM_LIMIT = getattr(settings, "LIVE_STREAM_LIMIT", 4)
+STREAMS = threading.BoundedSemaphore(STREAM_LIMIT)
+
+
+class LiveStream:
+    """Events of an open live stream, freeing its slot once closed."""
+
+    def __init__(self, events):
+        """Wrap the events of a stream that holds a slot."""
+
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        """Iterate over the events."""
+
+        return self
+
+    def __next__(self):
+        """Get the next event."""
+
+        return next(self.events)
+
+    def close(self):
+        """Stop the stream and free its slot, called with the response."""
+
+        if not self.closed:
+            self.closed = True
+            self.events.close()
+            STREAMS.release()
+
+
+def _live_event(event, version, data):
+    """Format a server-sent event."""
+
+    return "id: {}\nevent: {}\ndata: {}\n\n".format(version, event, json.dumps(data))
+
+
+def _live_stream(grader, last_event_id):
+    """Yield the live guts scoreboard as snapshot and update events.
+
+    Scores are keyed by team id as `[division, name, score]`. The first
+    event is a snapshot of the whole scoreboard unless the client is
+    already up to date. Later events only contain teams whose score
+    changed, and are only computed when the cached scores change.
+    """
+
+    yield "retry: 1000\n\n"
+
+    sent = {}
+    last_version = None
+    end = time.time() + STREAM_DURATION
+    while time.time() < end:
+        if grader.guts_live_round_scores.version() != last_version:
+            scores = grader.guts_live_round_scores(use_stale=True)
+            last_version = grader.guts_live_round_scores.version()
+            event_id = "{:.6f}".format(last_version[0] or 0)
+
+            current = {}
+            for division in scores:
+                for team in scores[division]:
+                    current[team.id] = [DIVISIONS_MAP[division], team.name, scores[division][team]]
+
+            if not sent:
+                if event_id != last_event_id:
+                    yield _live_event("snapshot", event_id, current)
+            else:
+                changes = {id: value for id, value in current.items() if sent.get(id) != value}
+                if changes:
+                    yield _live_event("update", event_id, changes)
+            sent = current
+
+        time.sleep(STREAM_INTERVAL)
+
+
+@staff_member_required
+def live_stream(request, round_id):
+    """Stream changes to the live scoreboard as server-sent events."""
+
+    if round_id != "guts":
+        return HttpResponse(status=404)
+
+    grader = Competition.current().grader
+    last_event_id = request.META.get("HTTP_LAST_EVENT_ID")
+    if not STREAMS.acquire(blocking=False):
+        response = HttpResponse(status=503)
+        response["Retry-After"] = STREAM_DURATION
+        return response
+
+    events = LiveStream(_live_stream(grader, last_event_id))
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _recalculate(grader, scoreboard: str, calculate):
+    """Recalculate a scoreboard in the background, snapshotting the result."""
+
+    def recalculate():
+        version = snapshots.answer_version(grader.competition)
+        calculate(use_cache=False)
+        snapshots.record(grader, version)
+
+    return jobs.executor.submit((grader.competition.id, scoreboard), recalculate)
+
+
 @login_required
 def sponsor_scoreboard(request):
     """Get the sponsor scoreboard."""
 
     grader = Competition.current().grader
+    version = snapshots.restore(grader)
 
     # Check subject scores
     subject_scores = grader.cache_get("subject_scores")
@@ -303,6 +581,7 @@ def sponsor_scoreboard(request):
     team_scores = grader.cache_get("team_overall_scores")
     if team_scores is None:
         team_scores = grader.calculate_team_scores(use_cache=True)
+    snapshots.record(grader, version)
 
     school = Coaching.current(coach=request.user).first().school
     individual_scores = grading.prepare_school_individual_scores(school, subject_scores)
@@ -325,22 +604,29 @@ def student_scoreboard(request):
     """Do final scoreboard calculations."""
 
     grader = Competition.current().grader
-
     if request.method == "POST" and "recalculate" in request.POST:
-        grader.calculate_individual_scores(use_cache=False)
+        _recalculate(grader, "individual", grader.calculate_individual_scores)
         return redirect("grading:scoreboard_students")
 
+    # Wait on a running recalculation rather than grading alongside it
+    job = jobs.executor.status((grader.competition.id, "individual"))
+    if job is not None and job.running:
+        return render(request, "grading/student/scoreboard.html", {"job": job})
+
+    version = snapshots.restore(grader)
     try:
         individual_scores = grading.prepare_individual_scores(
             grader.calculate_individual_scores(use_cache=True))
+        snapshots.record(grader, version)
         subject_scores = grading.prepare_subject_scores(grader.cache_get("subject_scores"))
         context = {
             "individual_scores": individual_scores,
             "subject_scores": subject_scores,
-            "individual_powers": grader.individual_powers,
-            "individual_bonus": grader.individual_bonus}
+            "individual_powers": grader.cache_get("individual_powers"),
+            "individual_bonus": grader.cache_get("individual_bonus")}
     except Exception:
         context = {"error": traceback.format_exc().replace("\n", "<br>")}
+    context["job"] = job
     return render(request, "grading/student/scoreboard.html", context)
 
 
@@ -350,11 +636,18 @@ def team_scoreboard(request):
 
     grader = Competition.current().grader
     if request.method == "POST" and "recalculate" in request.POST:
-        grader.calculate_team_scores(use_cache=False)
+        _recalculate(grader, "team", grader.calculate_team_scores)
         return redirect("grading:scoreboard_teams")
 
+    # Wait on a running recalculation rather than grading alongside it
+    job = jobs.executor.status((grader.competition.id, "team"))
+    if job is not None and job.running:
+        return render(request, "grading/team/scoreboard.html", {"job": job})
+
+    version = snapshots.restore(grader)
     try:
         team_scores = grader.calculate_team_scores(use_cache=True)
+        snapshots.record(grader, version)
         context = {
             "team_scores": grading.prepare_composite_team_scores(
                 grader.cache_get("raw_guts_scores"), grader.cache_get("guts_scores"),
@@ -363,57 +656,51 @@ def team_scoreboard(request):
                 team_scores)}
     except Exception:
         context = {"error": traceback.format_exc().replace("\n", "<br>")}
+    context["job"] = job
     return render(request, "grading/team/scoreboard.html", context)
 
 
+@staff_member_required
+def grader_plan(request):
+    """Show which grader every question of the competition resolves to."""
+
+    plan = Competition.current().grader.plan
+    rounds = []
+    for round_plan in sorted(plan.rounds.values(), key=lambda round_plan: round_plan.round.id):
+        rounds.append((round_plan.round, [(question, grader.__name__) for question, grader in round_plan]))
+    return render(request, "grading/plan.html", {"plan": plan, "rounds": rounds})
+
+
 @staff_member_required
 def statistics(request):
     """View statistics on the last competition."""
 
     current = Competition.current()
+    rounds = {round.ref: statistics_engine.round_statistics(round) for round in current.rounds.filter(
+        ref__in=("subject1", "subject2", "team", "guts"))}
+
     division_stats = []
     for division, division_name in DIVISIONS:
         stats = []
         subject_stats = []
         for subject, subject_name in SUBJECTS:
-            question_stats_dict = {}
-            for answer in Answer.objects.filter(
-                    Q(student__team__division=division) &
-                    Q(question__round__competition=current) &
-                    (Q(question__round__ref="subject1") & Q(student__subject1=subject) |
-                     Q(question__round__ref="subject2") & Q(student__subject2=subject))):
-                if answer.question.number not in question_stats_dict:
-                    question_stats_dict[answer.question.number] = [0, 0, 0]
-                if answer.value is None:
-                    question_stats_dict[answer.question.number][2] += 1
-                if answer.value == 1:
-                    question_stats_dict[answer.question.number][0] += 1
-                elif answer.value == 0:
-                    question_stats_dict[answer.question.number][1] += 1
-            subject_stats.append((subject_name,) + tuple(question_stats_dict.items()))
+            question_stats = collections.defaultdict(lambda: [0, 0, 0])
+            for round_ref in ("subject1", "subject2"):
+                if round_ref in rounds:
+                    for number, counts in rounds[round_ref].questions(division, subject):
+                        question_stats[number] = [x + y for x, y in zip(question_stats[number], counts)]
+            subject_stats.append((subject_name,) + tuple(sorted(question_stats.items())))
         stats.append(list(zip(*subject_stats)))
         for round_ref in ["team", "guts"]:
-            question_stats_dict = {}
-            estimation_guesses = {}
-            for answer in Answer.objects.filter(
-                    Q(team__division=division) &
-                    Q(question__round__competition=current) & Q(question__round__ref=round_ref)):
-                if answer.question.type == ESTIMATION:
-                    if answer.question.number not in estimation_guesses:
-                        estimation_guesses[answer.question.number] = []
-                    estimation_guesses[answer.question.number].append(answer.value)
-                    continue
-                if answer.question.number not in question_stats_dict:
-                    question_stats_dict[answer.question.number] = [0, 0, 0]
-                if answer.value is None:
-                    question_stats_dict[answer.question.number][2] += 1
-                if answer.value == 1:
-                    question_stats_dict[answer.question.number][0] += 1
-                elif answer.value == 0:
-                    question_stats_dict[answer.question.number][1] += 1
-            stats.append((round_ref, tuple(question_stats_dict.items())))
+            if round_ref not in rounds:
+                stats.append((round_ref, ()))
+                continue
+            stats.append((round_ref, tuple(rounds[round_ref].questions(division))))
+            estimation_guesses = tuple(
+                (number, sorted(guesses.elements(), key=lambda guess: (guess is None, guess or 0)))
+                for number, guesses in rounds[round_ref].estimations(division))
             if estimation_guesses:
-                stats.append((round_ref + " estimation", tuple(estimation_guesses.items())))
+                stats.append((round_ref + " estimation", estimation_guesses))
         division_stats.append((division_name, stats))
 
     return render(request, "grading/statistics.html", {"stats": division_stats, "current": current})
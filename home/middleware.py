@@ -0,0 +1,26 @@
+"""Middleware that resolves the active competition once per request."""
+
+from django.utils.deprecation import MiddlewareMixin
+
+from . import models
+
+
+class CurrentCompetitionMiddleware(MiddlewareMixin):
+    """Attach the active competition to each request.
+
+    The competition is also pinned for the thread handling the request,
+    so every call to `Competition.current()` during the request returns
+    the same object without touching the database.
+    """
+
+    def process_request(self, request):
+        """Resolve and pin the active competition."""
+
+        models.REQUEST.__dict__.pop("competition", None)
+        request.competition = models.REQUEST.competition = models.Competition.current()
+
+    def process_response(self, request, response):
+        """Unpin the competition once the response is ready."""
+
+        models.REQUEST.__dict__.pop("competition", None)
+        return response
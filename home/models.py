@@ -1,7 +1,26 @@
-from django.db import models
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+import time
+import threading
+
+
+# Seconds a process keeps the active competition before reloading it
+CURRENT_TIMEOUT = getattr(settings, "CURRENT_COMPETITION_TIMEOUT", 30)
+
+# Active competition cached by the process as (competition, loaded, stamp)
+CURRENT = {}
+
+# Stamp in the grader cache, shared by every process, bumped whenever a
+# competition is saved or deleted
+CURRENT_STAMP = "competition:changed"
+
+# Active competition pinned for the request handled by a thread
+REQUEST = threading.local()
+
 
 class Competition(models.Model):
     """An competition question container.
@@ -26,9 +45,11 @@ class Competition(models.Model):
     # Semantics
     year = models.CharField(max_length=20)  # First, second, etc.
 
-    # Grader path and cache
+    # Grader path
     _grader = models.CharField(max_length=40, null=True, blank=True)
-    _grader_instance = None
+
+    # Bumped whenever answers, questions, or attendance change
+    answer_version = models.IntegerField(default=0)
 
     def __repr__(self):
         """Represent the competition as a string."""
@@ -37,17 +58,74 @@ class Competition(models.Model):
 
     __str__ = __repr__
 
+    def save(self, *args, **kwargs):
+        """Save the competition and forget the cached active one."""
+
+        super().save(*args, **kwargs)
+        Competition.changed()
+
+    def delete(self, *args, **kwargs):
+        """Delete the competition and forget the cached active one."""
+
+        result = super().delete(*args, **kwargs)
+        Competition.changed()
+        return result
+
     @staticmethod
     def has_current() -> bool:
         """Check if there is an active competition."""
 
-        return Competition.objects.filter(active=True).exists()
+        return Competition.current() is not None
 
     @staticmethod
     def current() -> "Competition":
-        """Get the active competition."""
+        """Get the active competition.
+
+        The competition is pinned for the length of a request by the
+        current competition middleware, and is otherwise cached by the
+        process until a competition is saved in any process, which is
+        checked against a stamp in the shared grader cache, or until
+        CURRENT_TIMEOUT seconds pass, in case the stamp was lost.
+        """
+
+        if hasattr(REQUEST, "competition"):
+            return REQUEST.competition
+
+        stamp = Competition.stamps().get(CURRENT_STAMP)
+        cached = CURRENT.get("competition")
+        if cached is not None and cached[2] == stamp and time.time() - cached[1] < CURRENT_TIMEOUT:
+            return cached[0]
 
-        return Competition.objects.filter(active=True).first()
+        competition = Competition.objects.filter(active=True).first()
+        CURRENT["competition"] = (competition, time.time(), stamp)
+        return competition
+
+    @staticmethod
+    def current_id() -> int:
+        """Get the id of the active competition, or None if there is none."""
+
+        competition = Competition.current()
+        return competition.id if competition is not None else None
+
+    @staticmethod
+    def stamps():
+        """Get the cache shared by every process."""
+
+        return caches[getattr(settings, "GRADER_CACHE", "default")]
+
+    @staticmethod
+    def changed():
+        """Forget the cached active competition, in other processes once committed."""
+
+        Competition.forget_current()
+        transaction.on_commit(lambda: Competition.stamps().set(CURRENT_STAMP, time.time(), None))
+
+    @staticmethod
+    def forget_current():
+        """Drop the active competition cached by the process and request."""
+
+        CURRENT.pop("competition", None)
+        REQUEST.__dict__.pop("competition", None)
 
     def activate(self):
         """Set a competition as active."""
@@ -60,15 +138,10 @@ class Competition(models.Model):
 
     @property
     def grader(self):
-        """Instantiate a grader of the competition type."""
-
-        if Competition._grader_instance is not None:
-            return Competition._grader_instance
+        """Get the grader of the competition type from the registry."""
 
-        import importlib
-        grader = importlib.import_module(self._grader).Grader(self)
-        Competition._grader_instance = grader
-        return grader
+        from grading.grading import graders
+        return graders.get(self)
 
     @property
     def can_register(self):
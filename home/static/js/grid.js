@@ -0,0 +1,7 @@
+// Only submit the cells of the grid that differ from their saved value,
+// since a whole round has more cells than a request may hold fields
+$("form.grading").on("submit", function() {
+  $(this).find(".grid input").each(function() {
+    if (this.value.trim() === this.dataset.saved) this.removeAttribute("name");
+  });
+});
@@ -1,46 +1,99 @@
 let scoreboards;
 let frozen = false;
 
+// Latest scores by team id as [division, name, score]
+let teams = {};
+let streaming = false;
+
+function render(scores) {
+
+  if (frozen) {
+    console.log("Didn't update!");
+    return;
+  }
+
+  for (let division of Object.keys(scores)) {
+    const teams = [];
+    for (const team in scores[division])
+      if (scores[division].hasOwnProperty(team))
+        teams.push(team);
+    teams.sort((a, b) => scores[division][b] - scores[division][a]);
+
+    scoreboards[division + "1"].empty();
+    scoreboards[division + "2"].empty();
+
+    const half = Math.ceil(teams.length / 2);
+
+    for (let i = 0; i < teams.length; i++)
+      scoreboards[division + (i < half ? "1" : "2")].append(
+        "<tr><td>" + (i + 1) + "</td>" +
+        "<td class='team'>" + teams[i] + "</td>" +
+        "<td>" + Math.round(scores[division][teams[i]] * 1000) / 1000 + "</td></tr>");
+  }
+  console.log("Updated scoreboard!");
+}
+
+function renderTeams() {
+  const scores = {};
+  for (const id in teams) {
+    if (!teams.hasOwnProperty(id)) continue;
+    const [division, name, score] = teams[id];
+    if (!scores.hasOwnProperty(division)) scores[division] = {};
+    scores[division][name] = score;
+  }
+  render(scores);
+}
+
 function update() {
 
   console.log("Updating...");
-  if (frozen) console.log("Didn't update!");
 
   $.ajax("/grading/live/guts/update/").then(scores => {
-    scores = JSON.parse(scores);
-
-    for (let division of Object.keys(scores)) {
-      const teams = [];
-      for (const team in scores[division])
-        if (scores[division].hasOwnProperty(team))
-          teams.push(team);
-      teams.sort((a, b) => scores[division][b] - scores[division][a]);
-
-      scoreboards[division + "1"].empty();
-      scoreboards[division + "2"].empty();
-
-      const half = Math.ceil(teams.length / 2);
-
-      for (let i = 0; i < teams.length; i++)
-        scoreboards[division + (i < half ? "1" : "2")].append(
-          "<tr><td>" + (i + 1) + "</td>" +
-          "<td class='team'>" + teams[i] + "</td>" +
-          "<td>" + Math.round(scores[division][teams[i]] * 1000) / 1000 + "</td></tr>");
-    }
-    console.log("Updated scoreboard!");
+    render(JSON.parse(scores));
   }, error => console.log(error));
 }
 
+function poll() {
+  streaming = false;
+  update();
+  setInterval(update, 25*1000);
+}
+
+function stream() {
+  const source = new EventSource("/grading/live/guts/stream/");
+  streaming = true;
+
+  // The server refuses streams when too many are open, so poll instead
+  source.onerror = () => {
+    if (source.readyState === EventSource.CLOSED) poll();
+  };
+
+  source.addEventListener("snapshot", event => {
+    teams = JSON.parse(event.data);
+    renderTeams();
+  });
+
+  source.addEventListener("update", event => {
+    Object.assign(teams, JSON.parse(event.data));
+    renderTeams();
+  });
+}
+
 function freeze() {
   frozen = !frozen;
   if (frozen) document.getElementById("freeze").innerHTML = "Frozen!";
-  else document.getElementById("freeze").innerHTML = "Freeze!"
+  else {
+    document.getElementById("freeze").innerHTML = "Freeze!";
+    if (streaming) renderTeams();
+  }
 }
 
 window.onload = function() {
   scoreboards = {};
   for (let scoreboard of document.getElementsByClassName("scoreboard-body"))
     scoreboards[scoreboard.id] = $(scoreboard);
-  update();
-  setInterval(update, 25*1000);
+
+  // Fall back to polling where server-sent events are not supported
+  if (window.EventSource) stream();
+  else poll();
 };
@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.shortcuts import reverse
 from django.utils import timezone
 
@@ -44,3 +44,62 @@ class SiteTests(SiteEmptyTests):
             date_registration_end=later,
             date_team_edit_end=later,
             date_shirt_order_end=later)
+
+
+@override_settings(CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-default"},
+    "grading": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-grading"}})
+class CurrentCompetitionTests(TestCase):
+    """Test caching the active competition."""
+
+    def setUp(self):
+        """Create an active and an inactive competition."""
+
+        from django.core.cache import caches
+        caches["grading"].clear()
+
+        today = timezone.now().date()
+        fields = dict(date=today, date_registration_start=today, date_registration_end=today,
+                      date_edit_teams_end=today, date_edit_shirts_end=today, year="test")
+        self.active = models.Competition.objects.create(name="Active", active=True, **fields)
+        self.other = models.Competition.objects.create(name="Other", **fields)
+
+    def test_cached(self):
+        self.assertEqual(models.Competition.current(), self.active)
+        with self.assertNumQueries(0):
+            self.assertEqual(models.Competition.current_id(), self.active.id)
+
+        # Activating another competition is seen at once
+        self.other.activate()
+        self.assertEqual(models.Competition.current(), self.other)
+
+    def test_changed_elsewhere(self):
+        import time
+        from django.core.cache import caches
+        from django.conf import settings
+
+        self.assertEqual(models.Competition.current(), self.active)
+
+        # Another process activates a competition and publishes the change
+        models.Competition.objects.filter(id=self.active.id).update(active=False)
+        models.Competition.objects.filter(id=self.other.id).update(active=True)
+        self.assertEqual(models.Competition.current(), self.active)
+        caches[settings.GRADER_CACHE].set(models.CURRENT_STAMP, time.time(), None)
+        self.assertEqual(models.Competition.current(), self.other)
+
+    def test_middleware(self):
+        from django.test import RequestFactory
+        from django.http import HttpResponse
+        from .middleware import CurrentCompetitionMiddleware
+
+        middleware = CurrentCompetitionMiddleware()
+        request = RequestFactory().get("/")
+        middleware.process_request(request)
+        self.assertEqual(request.competition, self.active)
+
+        # Changes made elsewhere are not seen for the rest of the request
+        models.CURRENT["competition"] = (self.other, 0, None)
+        with self.assertNumQueries(0):
+            self.assertIs(models.Competition.current(), request.competition)
+        middleware.process_response(request, HttpResponse())
+        self.assertEqual(models.Competition.current(), self.active)
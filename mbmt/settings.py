@@ -50,6 +50,7 @@ MIDDLEWARE_CLASSES = [
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.auth.middleware.SessionAuthenticationMiddleware",
+    "home.middleware.CurrentCompetitionMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -86,6 +87,35 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# Grader results are shared between worker processes, so they need a
+# backend every worker can reach, such as the file system or memcached.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "grading": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(BASE_DIR, "cache", "grading"),
+        "TIMEOUT": None,
+    }
+}
+
+# Grader results and recomputation claims are shared by every worker
+# through this cache, so it must be one all workers can reach. Claims
+# need an atomic add, which memcached and the database backend provide
+# and the file based backend gets from a file lock on its directory.
+GRADER_CACHE = "grading"
+
+# Live scoreboard streams each hold a worker thread for up to half a
+# minute before the browser reconnects, so the server must run a threaded
+# or asynchronous worker class (for example gunicorn with gthread or
+# gevent workers). This many streams may be open per worker process.
+LIVE_STREAM_LIMIT = 4
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 